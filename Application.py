@@ -1,10 +1,11 @@
+import time
 import tkinter as tk
 from tkinter import ttk
-import pandas as pd
 from PIL import Image, ImageTk
-import requests
-from io import BytesIO
-from recfunctions import get_recommendations, get_game_id, rec_data
+from recfunctions import engine
+from exclusions import ExclusionList, OWNED, BLOCKED
+from virtuallist import VirtualListbox, game_label
+from imagecache import ImageFetcher, ThumbnailCache, THUMBNAIL_SIZE, make_session
 
 
 class GameSearchApp:
@@ -22,14 +23,25 @@ class GameSearchApp:
         self.root.grid_columnconfigure(1, weight=0)  # scrollbar column
         self.root.grid_rowconfigure(0, weight=1)
         
-        # Import recommendation functions and data
-        self.get_recommendations = get_recommendations
-        self.get_game_id = get_game_id
-        self.rec_data = rec_data
-        
-        # Load the games data
-        self.data = pd.read_csv('Data/rec_allgames.csv')
-        self.selected_games = []
+        # Recommendation engine, loaded now so the first search doesn't stall
+        self.engine = engine.warm()
+        self.get_recommendations = self.engine.get_recommendations
+        self.recommendation_cursor = self.engine.recommendation_cursor
+        self.cursor = None      # ranked recommendations of the last request, built on the first "Load more"
+        self.recommendation_request = None
+        self.get_game_id = self.engine.get_game_id
+        self.search_session = None
+        self.stats = self.engine.stats     # stage timings and cache counters, only recorded when enabled
+        
+        # Header images are fetched on background threads and shown once they arrive, a grey placeholder until then
+        self.thumbnails = ThumbnailCache(session=make_session(pool_size=8), timeout=(3.05, 10), stats=self.stats)
+        self.fetcher = ImageFetcher(self.root, self.thumbnails, max_workers=8)
+        self.placeholder = ImageTk.PhotoImage(Image.new('RGB', THUMBNAIL_SIZE, '#d9d9d9'))
+        self.selected_games = []     # AppIDs
+        
+        # Games the user owns or doesn't want recommended, kept in a file for next time
+        self.exclusions = ExclusionList.load('User/exclusions.bin')
+        self.exclusion_ids = []
         
         # Create main container frame
         self.container = ttk.Frame(root)
@@ -200,6 +212,9 @@ class GameSearchApp:
         )
         self.listbox.grid(row=4, column=0, padx=5, pady=(0, 20))
         
+        # Every match is kept, only the visible rows and a buffer are in the listbox, more get paged in on scroll
+        self.search_results = VirtualListbox(self.listbox, buffer=50)
+        
         # Add listbox scroll binding
         self.listbox.bind('<MouseWheel>', self._on_listbox_scroll)
         self.listbox.bind('<Button-4>', lambda e: self._on_listbox_scroll_linux(e, -1))
@@ -237,8 +252,43 @@ class GameSearchApp:
             label.grid(row=i, column=0, pady=10)
             self.selected_image_labels.append(label)
         
-        # Store selected game photos
-        self.selected_photos = []
+        # Owned / not interested games, never recommended
+        self.exclude_buttons = ttk.Frame(self.left_frame)
+        self.exclude_buttons.grid(row=8, column=0, padx=5, pady=(10, 5))
+        
+        self.owned_button = ttk.Button(
+            self.exclude_buttons,
+            text="I own this game",
+            command=lambda: self.exclude_game(OWNED)
+        )
+        self.owned_button.pack(side='left', padx=5)
+        
+        self.block_button = ttk.Button(
+            self.exclude_buttons,
+            text="Not interested",
+            command=lambda: self.exclude_game(BLOCKED)
+        )
+        self.block_button.pack(side='left', padx=5)
+        
+        self.exclusions_label = ttk.Label(
+            self.left_frame,
+            font=('Arial', 11)
+        )
+        self.exclusions_label.grid(row=9, column=0, padx=5, pady=(0, 5))
+        
+        self.exclusions_listbox = tk.Listbox(
+            self.left_frame,
+            width=50,
+            height=5,
+            font=('Arial', 10),
+            exportselection=False
+        )
+        self.exclusions_listbox.grid(row=10, column=0, padx=5, pady=(0, 20))
+        self.exclusions_listbox.bind('<Double-Button-1>', self.remove_exclusion)
+        self.exclusions_listbox.bind('<MouseWheel>', self._on_listbox_scroll)
+        self.exclusions_listbox.bind('<Button-4>', lambda e: self._on_listbox_scroll_linux(e, -1))
+        self.exclusions_listbox.bind('<Button-5>', lambda e: self._on_listbox_scroll_linux(e, 1))
+        self.update_exclusions_display()
         
         # Bind selection event
         self.listbox.bind('<Double-Button-1>', self.select_game)
@@ -277,9 +327,6 @@ class GameSearchApp:
         self.recommended_games_frame = ttk.Frame(self.recommendations_frame)
         self.recommended_games_frame.pack(fill=tk.BOTH, expand=True)
         
-        # List to store recommendation image labels
-        self.recommendation_images = []
-        
         # Add mousewheel bindings to all relevant widgets
         widgets_to_bind = [self.root, self.canvas, self.scrollable_frame, 
                           self.main_frame, self.left_frame]
@@ -294,6 +341,16 @@ class GameSearchApp:
         self.scrollable_frame.bind_all('<Button-4>', lambda e: self.canvas.yview_scroll(-1, 'units'))
         self.scrollable_frame.bind_all('<Button-5>', lambda e: self.canvas.yview_scroll(1, 'units'))
         
+    @property
+    def data(self):
+        """All the games (from the engine so a reload is picked up)"""
+        return self.engine.full_data
+
+    @property
+    def rec_data(self):
+        """Games that can be recommended"""
+        return self.engine.rec_data
+
     def _start_scroll(self, event):
         """Store the initial position when middle click is pressed"""
         self.canvas.scan_mark(event.x, event.y)
@@ -313,67 +370,123 @@ class GameSearchApp:
                 return
                 
             # Get selected game
-            selection = self.listbox.get(self.listbox.curselection())
-            game_id = selection.split("ID: ")[1].rstrip(")")
-            
-            # Get game's header image URL
-            game_data = self.data[self.data['AppID'] == int(game_id)].iloc[0]
-            image_url = game_data['Header image']
-            
-            # Fetch and display the image
-            response = requests.get(image_url)
-            image_data = BytesIO(response.content)
-            image = Image.open(image_data)
-            
-            # Resize image to reasonable dimensions
-            image = image.resize((300, 140), Image.Resampling.LANCZOS)
+            game_id = self.search_results.selected_app_id()
             
-            # Convert to PhotoImage and keep a reference
-            self.photo = ImageTk.PhotoImage(image)
-            self.image_label.config(image=self.photo)
+            # Show the game's header image, a newer selection cancels this one
+            self.fetcher.new_batch('preview')
+            self._load_thumbnail('preview', game_id, self.image_label)
             
         except Exception as e:
             # Clear image if there's an error
             self.image_label.config(image='')
             print(f"Error loading image: {e}")
         
+    def _load_thumbnail(self, group, game_id, label, error_text=''):
+        """Shows the placeholder in label right away and the game's 300x140 header image once it is fetched"""
+        row = self.engine.state.catalog_index.row(game_id)
+        if row is None:
+            raise ValueError(f"Game ID {game_id} not found in dataset")
+        image_url = self.data['Header image'].values[row]
+        
+        label.config(image=self.placeholder)
+        requested = time.perf_counter()
+        
+        def show(image):
+            self.stats.add_time('app.thumbnail', time.perf_counter() - requested)
+            if label.winfo_exists():
+                label.image = ImageTk.PhotoImage(image)  # keep a reference so Tk doesn't lose the image
+                label.config(image=label.image)
+        
+        def failed(error):
+            print(f"Error loading image: {error}")
+            if label.winfo_exists():
+                label.config(image='', text=error_text)
+        
+        self.fetcher.fetch(group, game_id, image_url, show, failed)
+        
     def update_list(self, *args):
-        search_term = self.search_var.get().lower()
-        self.listbox.delete(0, tk.END)
-        
-        # Filter games based on search term
-        if search_term:
-            matches = self.data[self.data['Name'].str.lower().str.contains(search_term, na=False)]
-            # Sort matches by wilson_score in descending order
-            matches = matches.sort_values('wilson_score', ascending=False)
-            for _, game in matches.iterrows():
-                if len(matches) > 100:  # Limit results to prevent lag
-                    break
-                self.listbox.insert(tk.END, f"{game['Name']} (ID: {game['AppID']})")
+        search_term = self.search_var.get()
+        
+        # Matches come back sorted by wilson_score, all of them are kept but only the visible ones get inserted
+        with self.stats.timer('app.search'):
+            names, app_ids = self._search_session().search(search_term, limit=None)
+            self.search_results.set_items(names, app_ids)
+    
+    def _search_session(self):
+        """Search session over the engine's name index, started again if the engine reloaded"""
+        index = self.engine.search_index
+        if self.search_session is None or self.search_session.index is not index:
+            self.search_session = index.session()
+        return self.search_session
     
     def select_game(self, event):
         if len(self.selected_games) >= 3:
             return
         
-        selection = self.listbox.get(self.listbox.curselection())
-        if selection not in self.selected_games:
-            self.selected_games.append(selection)
+        game_id = self.search_results.selected_app_id()
+        if game_id is not None and game_id not in self.selected_games:
+            self.selected_games.append(game_id)
             self.update_selected_games_display()
     
     def remove_game(self, event):
-        try:
-            selection = self.selected_listbox.get(self.selected_listbox.curselection())
-            self.selected_games.remove(selection)
+        selection = self.selected_listbox.curselection()
+        if selection:
+            del self.selected_games[selection[0]]
             self.update_selected_games_display()
-        except:
-            pass
+    
+    def _game_label(self, game_id):
+        """Display string of a game from its AppID"""
+        row = self.engine.state.catalog_index.row(game_id)
+        return game_label(self.data['Name'].values[row] if row is not None else "Unknown game", game_id)
+    
+    def exclude_game(self, kind):
+        """Marks the game selected in the search results as owned or not interested and saves the list"""
+        game_id = self.search_results.selected_app_id()
+        if game_id is None:
+            return
+        self.exclusions.add(game_id, kind)
+        self._save_exclusions()
+    
+    def remove_exclusion(self, event):
+        if not self.exclusions_listbox.curselection():
+            return
+        self.exclusions.remove(self.exclusion_ids[self.exclusions_listbox.curselection()[0]])
+        self._save_exclusions()
+    
+    def _save_exclusions(self):
+        try:
+            self.exclusions.save()
+        except OSError as e:
+            print(f"Error saving excluded games: {e}")
+        self.update_exclusions_display()
+    
+    def update_exclusions_display(self):
+        """Lists the owned and not interested games by name, double click removes one"""
+        catalog_index = self.engine.state.catalog_index
+        names = self.data['Name'].values
+        
+        entries = []
+        for app_id in self.exclusions.app_ids():
+            row = catalog_index.row(app_id)
+            name = names[row] if row is not None else "Unknown game"
+            label = "owned" if self.exclusions.kind(app_id) == OWNED else "not interested"
+            entries.append((str(name).lower(), app_id, f"{game_label(name, app_id)} - {label}"))
+        entries.sort()
+        
+        self.exclusion_ids = [app_id for _, app_id, _ in entries]
+        self.exclusions_listbox.delete(0, tk.END)
+        if entries:
+            self.exclusions_listbox.insert(tk.END, *[text for _, _, text in entries])
+        self.exclusions_label.config(text=f"Owned / not interested ({len(entries)}), never recommended:")
     
     def update_selected_games_display(self):
         self.selected_listbox.delete(0, tk.END)
-        for i, game in enumerate(self.selected_games):
-            self.selected_listbox.insert(tk.END, game)
+        self.fetcher.new_batch('selected')
+        if self.selected_games:
+            self.selected_listbox.insert(tk.END, *[self._game_label(game_id) for game_id in self.selected_games])
+        for i, game_id in enumerate(self.selected_games):
             # Update image for this slot
-            self.update_selected_game_image(i, game)
+            self.update_selected_game_image(i, game_id)
             
         # Clear remaining image slots
         for i in range(len(self.selected_games), 3):
@@ -387,36 +500,26 @@ class GameSearchApp:
         else:
             self.recommend_button.config(state='disabled')
 
-    def update_selected_game_image(self, index, game):
+    def update_selected_game_image(self, index, game_id):
         try:
-            game_id = game.split("ID: ")[1].rstrip(")")
-            game_data = self.data[self.data['AppID'] == int(game_id)].iloc[0]
-            image_url = game_data['Header image']
-            
-            response = requests.get(image_url)
-            image_data = BytesIO(response.content)
-            image = Image.open(image_data)
-            image = image.resize((300, 140), Image.Resampling.LANCZOS)
-            
-            # Keep reference to photo
-            if len(self.selected_photos) <= index:
-                self.selected_photos.append(None)
-            self.selected_photos[index] = ImageTk.PhotoImage(image)
-            
-            self.selected_image_labels[index].config(image=self.selected_photos[index])
+            self._load_thumbnail('selected', game_id, self.selected_image_labels[index])
         except Exception as e:
             print(f"Error loading image: {e}")
             self.selected_image_labels[index].config(image='')
 
     def show_recommendations(self):
+        with self.stats.timer('app.show_recommendations'):
+            self._show_recommendations()
+    
+    def _show_recommendations(self):
         # Clear previous recommendations
         for widget in self.recommended_games_frame.winfo_children():
             widget.destroy()
-        self.recommendation_images = []
+        self.fetcher.new_batch('recommendations')
         
         try:
-            # Get AppIDs of selected games
-            game_ids = [int(game.split("ID: ")[1].rstrip(")")) for game in self.selected_games]
+            # AppIDs of selected games
+            game_ids = list(self.selected_games)
             
             if len(game_ids) < 1:
                 raise ValueError("Please select at least one game for recommendations.")
@@ -438,20 +541,30 @@ class GameSearchApp:
                 except ValueError:
                     raise ValueError("Invalid wilson score value")
             
-            # Get recommendations using the existing function
+            # The first page of n comes from get_recommendations (result cache, neighbour table, shards),
+            # "Load more" pages on through a cursor that starts after it
             n_recommendations = int(self.rec_count.get())
+            self.cursor = None
             recommended_indices, similarity_scores = self.get_recommendations(
                 game_ids, 
                 n=n_recommendations,
                 max_price=max_price,
-                min_wilson_score=min_wilson
+                min_wilson_score=min_wilson,
+                exclusions=self.exclusions
+            )
+            self.recommendation_request = dict(
+                user_games=game_ids,
+                page_size=n_recommendations,
+                max_price=max_price,
+                min_wilson_score=min_wilson,
+                exclusions=self.exclusions,
+                ranked=recommended_indices
             )
             
             if not recommended_indices:
                 raise ValueError("No recommendations found matching the specified criteria")
             
-            # Get recommended games data
-            recommended_games = self.rec_data.iloc[recommended_indices]
+            render_start = time.perf_counter()
             
             # Add a title for recommendations
             title_label = ttk.Label(
@@ -463,49 +576,27 @@ class GameSearchApp:
             title_label.pack(pady=(0, 20))
             
             # Create a frame to hold all recommendation cards
-            cards_frame = ttk.Frame(self.recommended_games_frame)
-            cards_frame.pack(expand=True, fill='both')
+            self.cards_frame = ttk.Frame(self.recommended_games_frame)
+            self.cards_frame.pack(expand=True, fill='both')
             
             # Configure grid weights to center the cards
-            cards_frame.grid_columnconfigure(0, weight=1)
-            cards_frame.grid_columnconfigure(1, weight=1)
-            cards_frame.grid_columnconfigure(2, weight=1)
+            self.cards_frame.grid_columnconfigure(0, weight=1)
+            self.cards_frame.grid_columnconfigure(1, weight=1)
+            self.cards_frame.grid_columnconfigure(2, weight=1)
+            self.shown_recommendations = 0
+            self.add_recommendation_cards(recommended_indices, similarity_scores)
             
-            # Display each recommended game
-            for idx, (_, game) in enumerate(recommended_games.iterrows()):
-                row = idx // 3  # Integer division to determine row
-                col = idx % 3   # Modulo to determine column
-                
-                game_frame = ttk.Frame(cards_frame)
-                game_frame.grid(row=row, column=col, padx=20, pady=5)
-                
-                # Add game name and similarity score
-                name_label = ttk.Label(
-                    game_frame, 
-                    text=f"{game['Name']}\nSimilarity: {similarity_scores[idx]:.2f} | Price: ${game['Price']:.2f}",
-                    wraplength=300,
-                    justify='center',
-                    font=('Arial', 10)
-                )
-                name_label.pack(pady=(0, 10))
-                
-                # Add game image
-                try:
-                    header_image = self.data[self.data['AppID'] == game['AppID']]['Header image'].iloc[0]
-                    
-                    response = requests.get(header_image)
-                    image_data = BytesIO(response.content)
-                    image = Image.open(image_data)
-                    image = image.resize((300, 140), Image.Resampling.LANCZOS)
-                    photo = ImageTk.PhotoImage(image)
-                    self.recommendation_images.append(photo)
-                    
-                    image_label = ttk.Label(game_frame, image=photo)
-                    image_label.pack(pady=5)
-                except Exception as e:
-                    print(f"Error loading recommendation image: {e}")
-                    error_label = ttk.Label(game_frame, text="Image unavailable")
-                    error_label.pack(pady=5)
+            # More of the same ranking, the next page of n games on every click
+            self.load_more_button = ttk.Button(
+                self.recommended_games_frame,
+                text="Load more",
+                command=self.load_more_recommendations
+            )
+            self.load_more_button.pack(pady=10)
+            if len(recommended_indices) < n_recommendations:
+                self.load_more_button.config(state='disabled')
+            
+            self.stats.add_time('app.render_recommendations', time.perf_counter() - render_start)
                     
         except Exception as e:
             print(f"Error getting recommendations: {e}")
@@ -518,6 +609,53 @@ class GameSearchApp:
             )
             error_label.pack(pady=20)
 
+    def add_recommendation_cards(self, recommended_indices, similarity_scores):
+        """Adds a card (name, similarity, price and header image) for every recommended rec_data row, 3 per row"""
+        recommended_games = self.rec_data.iloc[recommended_indices]
+        
+        for idx, (_, game) in enumerate(recommended_games.iterrows()):
+            position = self.shown_recommendations + idx
+            row = position // 3  # Integer division to determine row
+            col = position % 3   # Modulo to determine column
+            
+            game_frame = ttk.Frame(self.cards_frame)
+            game_frame.grid(row=row, column=col, padx=20, pady=5)
+            
+            # Add game name and similarity score
+            name_label = ttk.Label(
+                game_frame, 
+                text=f"{game['Name']}\nSimilarity: {similarity_scores[idx]:.2f} | Price: ${game['Price']:.2f}",
+                wraplength=300,
+                justify='center',
+                font=('Arial', 10)
+            )
+            name_label.pack(pady=(0, 10))
+            
+            # Add game image, it fills in when the download finishes
+            try:
+                image_label = ttk.Label(game_frame)
+                image_label.pack(pady=5)
+                self._load_thumbnail('recommendations', game['AppID'], image_label, error_text="Image unavailable")
+            except Exception as e:
+                print(f"Error loading recommendation image: {e}")
+                error_label = ttk.Label(game_frame, text="Image unavailable")
+                error_label.pack(pady=5)
+        
+        self.shown_recommendations += len(recommended_indices)
+    
+    def load_more_recommendations(self):
+        """Shows the next page of the current recommendations, only the new page gets ranked"""
+        if self.recommendation_request is None:
+            return
+        with self.stats.timer('app.load_more'):
+            if self.cursor is None:
+                self.cursor = self.recommendation_cursor(**self.recommendation_request)
+            recommended_indices, similarity_scores = self.cursor.next_page()
+            if recommended_indices:
+                self.add_recommendation_cards(recommended_indices, similarity_scores)
+        if not self.cursor.has_more:
+            self.load_more_button.config(state='disabled')
+
     def on_canvas_configure(self, event):
         """Update the canvas window size when the canvas is resized"""
         # Update the width of the canvas window
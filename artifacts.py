@@ -0,0 +1,389 @@
+'''
+Binary artifact format for the recommender, so a process can start by memory mapping files instead of
+parsing the CSVs and unpickling the model.
+
+An artifact set holds:
+- manifest.json: format version, row counts, matrix shapes and the scaler/vectorizer parameters
+- one .npy file per numeric catalog column
+- string catalog columns as one .npy of UTF-8 bytes (values separated by a 0 byte) plus a .npy of offsets
+- data/indices/indptr .npy files of every CSR matrix (float64, or float32 values with int32 indices with --compact)
+
+Every .npy file is loaded with mmap_mode='r', so worker processes on the same host share one page cache copy.
+
+The manifest also records the size, mtime and hash of the CSVs and pickles an export was made from, so the engine
+can tell when builddata.py or the notebooks regenerated them after the export (see changed_sources).
+
+An artifact directory (Artifacts/) keeps every set in its own version directory and a CURRENT file with the name
+of the one to load. A write adds a new version and switches CURRENT, it never renames or overwrites a directory
+another process may still have mapped (which Windows doesn't allow). Old versions are removed once they are no
+longer in use, the ones that still are get removed by a later write.
+
+Usage:
+python artifacts.py export --out Artifacts
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import MinMaxScaler
+
+FORMAT = 'sgrs-artifacts'
+FORMAT_VERSION = 1
+
+SCALER_ATTRIBUTES = ['min_', 'scale_', 'data_min_', 'data_max_', 'data_range_', 'n_samples_seen_']
+
+CURRENT_FILE = 'CURRENT'
+
+# Files an export is made from, by the directory they are in
+SOURCE_FILES = {'data': ['rec_allgames.csv', 'rec_data.csv'],
+                'model': ['scaler.pkl', 'scaler1.pkl', 'vectorizer.pkl', 'weighted_features.pkl']}
+VERSION_PATTERN = re.compile(r'v\d{8}-\d{6}(-\d+)?(\.tmp)?$')
+
+
+def _save_column(out_dir, table, column, values, manifest):
+    prefix = f"{table}.{column}"
+
+    if values.dtype.kind in 'biuf':
+        np.save(os.path.join(out_dir, prefix + '.npy'), np.ascontiguousarray(values))
+        manifest[column] = {'kind': 'numeric', 'file': prefix + '.npy'}
+        return
+
+    # Strings: missing values are stored as empty strings
+    strings = ['' if pd.isna(value) else str(value) for value in values]
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) + 1 for value in encoded], out=offsets[1:])
+
+    np.save(os.path.join(out_dir, prefix + '.bytes.npy'), np.frombuffer(b'\0'.join(encoded) + b'\0', dtype=np.uint8))
+    np.save(os.path.join(out_dir, prefix + '.offsets.npy'), offsets)
+    manifest[column] = {'kind': 'string', 'file': prefix + '.bytes.npy', 'offsets': prefix + '.offsets.npy'}
+
+
+def _save_matrix(out_dir, name, matrix, manifest):
+    matrix = csr_matrix(matrix)
+    matrix.sort_indices()
+    files = {}
+    for part in ('data', 'indices', 'indptr'):
+        files[part] = f"{name}.{part}.npy"
+        np.save(os.path.join(out_dir, files[part]), getattr(matrix, part))
+    manifest[name] = {'shape': list(matrix.shape), 'dtype': matrix.dtype.name, **files}
+
+
+def _scaler_params(scaler):
+    params = {name: np.asarray(getattr(scaler, name)).tolist() for name in SCALER_ATTRIBUTES}
+    params['feature_range'] = list(scaler.feature_range)
+    return params
+
+
+def _vectorizer_params(vectorizer):
+    params = {}
+    for name, value in vectorizer.get_params().items():
+        if name == 'dtype':
+            params[name] = np.dtype(value).name
+        elif value is None or isinstance(value, (str, int, float, bool, tuple, list)):
+            params[name] = value
+    return params
+
+
+def _file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stamp_sources(data_dir='Data', model_dir='Stuff'):
+    '''Size, mtime and hash of the source files (SOURCE_FILES) that exist, for the manifest'''
+    stamps = {}
+    for kind, directory in (('data', data_dir), ('model', model_dir)):
+        for name in SOURCE_FILES[kind]:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                stamps[f"{kind}/{name}"] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                            'blake2b': _file_hash(path)}
+    return stamps
+
+
+def changed_sources(manifest, data_dir='Data', model_dir='Stuff'):
+    '''
+    Source files that changed since the export the manifest belongs to. Only files with another size or mtime get
+    hashed, so a copy or checkout that only touched the mtime doesn't count. Missing files don't count either
+    (a deployment with only the artifacts), neither do artifacts written without stamps.
+
+    output:
+    list of the paths of the changed files
+    '''
+    directories = {'data': data_dir, 'model': model_dir}
+    changed = []
+    for source, stamp in manifest.get('sources', {}).items():
+        kind, name = source.split('/', 1)
+        path = os.path.join(directories[kind], name)
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        if stat.st_size == stamp['size'] and stat.st_mtime_ns == stamp['mtime_ns']:
+            continue
+        if stat.st_size != stamp['size'] or _file_hash(path) != stamp['blake2b']:
+            changed.append(path)
+    return changed
+
+
+def current_artifacts(path):
+    '''
+    Directory of the artifact set path points to: the version named in its CURRENT file, or path itself
+    (a version directory, or an artifact directory written before there were versions)
+    '''
+    try:
+        with open(os.path.join(path, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except OSError:
+        return path
+    return os.path.join(path, version)
+
+
+def _new_version(out_dir):
+    version = time.strftime('v%Y%m%d-%H%M%S')
+    name, count = version, 0
+    while os.path.exists(os.path.join(out_dir, name)) or os.path.exists(os.path.join(out_dir, name + '.tmp')):
+        count += 1
+        name = f"{version}-{count}"
+    return name
+
+
+def _remove_old_versions(out_dir, keep):
+    '''
+    Removes every version directory but keep, and the files of an artifact set written before there were versions.
+    Files another process still has open or mapped can't be removed on Windows, they are left for the next write.
+    '''
+    for entry in os.scandir(out_dir):
+        if entry.name == keep:
+            continue
+        try:
+            if entry.is_dir() and VERSION_PATTERN.match(entry.name):
+                shutil.rmtree(entry.path)
+            elif entry.is_file() and (entry.name == 'manifest.json' or entry.name.endswith('.npy')):
+                os.remove(entry.path)
+        except OSError as e:
+            print(f"Could not remove the old artifacts {entry.path} ({e}), still in use? The next write retries")
+
+
+def write_artifacts(out_dir, full_data, rec_data, scaler, scaler1, vectorizer, weighted_features, full_features,
+                    normalized_features, sources=None):
+    '''
+    Writes a new version of the artifact set into the artifact directory out_dir and makes it the current one.
+    sources are the stamp_sources of the files it was made from (none for generated data).
+    The files are written under a temporary name first and CURRENT is only switched at the end (os.replace of a
+    small file), so a process loading out_dir never sees a half written set and nothing in use gets renamed.
+
+    output:
+    the directory of the new version
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    version = _new_version(out_dir)
+    tmp_dir = os.path.join(out_dir, version + '.tmp')
+    os.makedirs(tmp_dir)
+
+    manifest = {
+        'format': FORMAT,
+        'version': FORMAT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'tables': {},
+        'matrices': {},
+        'scalers': {'scaler': _scaler_params(scaler), 'scaler1': _scaler_params(scaler1)},
+        'vectorizer': {'params': _vectorizer_params(vectorizer)},
+        'sources': sources or {},
+    }
+
+    for table, data in (('full_data', full_data), ('rec_data', rec_data)):
+        columns = {}
+        for column in data.columns:
+            _save_column(tmp_dir, table, column, data[column].values, columns)
+        manifest['tables'][table] = {'rows': len(data), 'columns': columns}
+
+    for name, matrix in (('weighted_features', weighted_features), ('full_features', full_features),
+                         ('normalized_features', normalized_features)):
+        _save_matrix(tmp_dir, name, matrix, manifest['matrices'])
+
+    # Vocabulary terms in column order plus the idf weights
+    terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+    vocabulary = {}
+    _save_column(tmp_dir, 'vectorizer', 'vocabulary', terms, vocabulary)
+    np.save(os.path.join(tmp_dir, 'vectorizer.idf.npy'), vectorizer.idf_)
+    manifest['vectorizer'].update(vocabulary=vocabulary['vocabulary'], idf='vectorizer.idf.npy')
+
+    # The manifest goes last, a directory without one is never loaded
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    version_dir = os.path.join(out_dir, version)
+    os.rename(tmp_dir, version_dir)
+
+    pointer = os.path.join(out_dir, CURRENT_FILE)
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(pointer + '.tmp', pointer)
+
+    _remove_old_versions(out_dir, version)
+    return version_dir
+
+
+def has_artifacts(path):
+    return os.path.exists(os.path.join(current_artifacts(path), 'manifest.json'))
+
+
+def read_manifest(path):
+    path = current_artifacts(path)
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    if manifest.get('format') != FORMAT or manifest.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path} has artifact format {manifest.get('format')} v{manifest.get('version')}, "
+                         f"expected {FORMAT} v{FORMAT_VERSION}. Re-export it with artifacts.py")
+    return manifest
+
+
+def _load_column(path, spec, mmap=True):
+    values = np.load(os.path.join(path, spec['file']), mmap_mode='r' if mmap else None)
+    if spec['kind'] == 'numeric':
+        return values
+
+    # Decoding everything in one go is much faster than slicing each value out with the offsets
+    strings = values.tobytes().decode('utf-8').split('\0')[:-1]
+    return np.array(strings, dtype=object)
+
+
+def matrix_spec(path, manifest, name, compact=False):
+    '''
+    Files of a stored matrix. With compact=True a float64 matrix gets a float32 values / int32 indices copy
+    (recfunctions.compact_matrix) written next to it on first use, so compact engines and their scoring
+    workers memory map that one and share a single page cache copy too.
+    '''
+    spec = manifest['matrices'][name]
+    if not compact or spec.get('dtype') == 'float32':
+        return spec
+
+    files = {}
+    for part, dtype in (('data', np.float32), ('indices', np.int32), ('indptr', np.int32)):
+        files[part] = f"{name}.compact.{part}.npy"
+        target = os.path.join(path, files[part])
+        if not os.path.exists(target):
+            # The stored indices are already sorted, converting keeps them that way
+            values = np.load(os.path.join(path, spec[part]), mmap_mode='r')
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, values.astype(dtype))
+            os.replace(tmp_path, target)
+    return {**spec, 'dtype': 'float32', **files}
+
+
+def _load_matrix(path, spec, mmap=True):
+    parts = [np.load(os.path.join(path, spec[part]), mmap_mode='r' if mmap else None)
+             for part in ('data', 'indices', 'indptr')]
+    return csr_matrix(tuple(parts), shape=tuple(spec['shape']), copy=False)
+
+
+def _load_scaler(params):
+    scaler = MinMaxScaler(feature_range=tuple(params['feature_range']))
+    for name in SCALER_ATTRIBUTES:
+        setattr(scaler, name, np.asarray(params[name]))
+    scaler.n_features_in_ = len(params['min_'])
+    return scaler
+
+
+def _load_vectorizer(path, spec):
+    params = dict(spec['params'])
+    params['dtype'] = np.dtype(params.get('dtype', 'float64')).type
+    if isinstance(params.get('ngram_range'), list):
+        params['ngram_range'] = tuple(params['ngram_range'])
+
+    vectorizer = TfidfVectorizer(**params)
+    terms = _load_column(path, spec['vocabulary'])
+    vectorizer.vocabulary_ = {term: column for column, term in enumerate(terms)}
+    vectorizer.idf_ = np.load(os.path.join(path, spec['idf']))
+    return vectorizer
+
+
+def load_artifacts(path, include_text=False, mmap=True, compact=False):
+    '''
+    Loads the current artifact set of a directory written by write_artifacts.
+
+    Numeric columns and matrices are memory mapped read-only, only the string columns get decoded.
+    With mmap=False everything is read into memory and no file stays open (to write a new version from it
+    while the old one gets removed).
+    combined_info is only needed to featurize games, so it is skipped unless include_text is True.
+    compact=True maps the float32 copies of the matrices (see matrix_spec).
+
+    output:
+    dict with full_data, rec_data, scaler, scaler1, vectorizer, weighted_features, full_features,
+    normalized_features, the manifest and the path of the version that was loaded
+    '''
+    path = current_artifacts(path)
+    manifest = read_manifest(path)
+    artifacts = {'manifest': manifest, 'path': path}
+
+    for table, spec in manifest['tables'].items():
+        columns = {column: _load_column(path, column_spec, mmap) for column, column_spec in spec['columns'].items()
+                   if include_text or column != 'combined_info'}
+        artifacts[table] = pd.DataFrame(columns, copy=False)
+
+    for name in manifest['matrices']:
+        artifacts[name] = _load_matrix(path, matrix_spec(path, manifest, name, compact and mmap), mmap)
+
+    artifacts['scaler'] = _load_scaler(manifest['scalers']['scaler'])
+    artifacts['scaler1'] = _load_scaler(manifest['scalers']['scaler1'])
+    artifacts['vectorizer'] = _load_vectorizer(path, manifest['vectorizer'])
+    return artifacts
+
+
+def export_artifacts(out_dir='Artifacts', data_dir='Data', model_dir='Stuff', compact=False):
+    '''
+    Exports the CSVs and pickled model (the files MatrixCalc.ipynb and datacleaning.ipynb write) as artifacts.
+    compact=True stores the matrices as float32 with int32 indices (recfunctions.compact_matrix).
+    '''
+    import joblib
+    from recfunctions import compact_matrix, featurize
+    from sklearn.preprocessing import normalize
+
+    sources = stamp_sources(data_dir, model_dir)
+    full_data = pd.read_csv(os.path.join(data_dir, 'rec_allgames.csv'))
+    rec_data = pd.read_csv(os.path.join(data_dir, 'rec_data.csv'))
+    scaler = joblib.load(os.path.join(model_dir, 'scaler.pkl'))
+    scaler1 = joblib.load(os.path.join(model_dir, 'scaler1.pkl'))
+    vectorizer = joblib.load(os.path.join(model_dir, 'vectorizer.pkl'))
+    weighted_features = csr_matrix(joblib.load(os.path.join(model_dir, 'weighted_features.pkl')))
+
+    full_features = featurize(full_data, vectorizer, scaler, scaler1)
+    normalized_features = normalize(weighted_features)
+    if compact:
+        weighted_features, full_features, normalized_features = (
+            compact_matrix(matrix) for matrix in (weighted_features, full_features, normalized_features))
+
+    write_artifacts(out_dir, full_data, rec_data, scaler, scaler1, vectorizer, weighted_features, full_features,
+                    normalized_features, sources)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export the recommender data and model as memory mappable artifacts')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='write an artifact directory from Data/ and Stuff/')
+    export_parser.add_argument('--out', default='Artifacts')
+    export_parser.add_argument('--data-dir', default='Data')
+    export_parser.add_argument('--model-dir', default='Stuff')
+    export_parser.add_argument('--compact', action='store_true', help='float32 values and int32 indices')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    export_artifacts(args.out, args.data_dir, args.model_dir, args.compact)
+    print(f"Exported artifacts to {args.out} in {time.perf_counter() - start:.1f}s")
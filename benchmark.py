@@ -0,0 +1,261 @@
+'''
+Benchmarks of the recommender on synthetic catalogs.
+
+For every catalog size a synthetic catalog with the rec_allgames.csv columns and a Steam-like tag vocabulary is
+generated, the model is fit on it (the MatrixCalc.ipynb steps) and written as artifacts. A fresh process then measures:
+- engine startup (import + warm) time
+- get_game_id, preprocess_user_input and get_recommendations (with and without filters) latency p50/p95/p99
+- peak RSS
+- with --compact, the same with float32 / int32 artifacts (artifacts.py export --compact)
+- with --workers N, the same with sharded scoring on N processes (RecommenderEngine(workers=N))
+- with --stats, the per-stage timings and counters of stats.py over all the measured calls
+
+Results are written as JSON so runs from different commits can be compared.
+
+Usage:
+python benchmark.py --sizes 10000 100000 1000000 --out bench_results.json
+python benchmark.py --compare old_results.json bench_results.json
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Common Steam categories, genres and tags, more popular ones first (picked with a Zipf-like distribution)
+TAGS = [
+    'Single-player', 'Indie', 'Action', 'Casual', 'Adventure', 'Steam Achievements', 'Simulation', 'Strategy',
+    'Full controller support', 'Steam Cloud', 'RPG', '2D', 'Multi-player', 'Puzzle', 'Pixel Graphics', 'Atmospheric',
+    'Colorful', 'Exploration', 'Early Access', 'Cute', 'First-Person', 'Family Friendly', 'Fantasy', 'Story Rich',
+    'Arcade', 'Partial Controller Support', 'Steam Trading Cards', 'Shooter', 'Funny', 'Platformer', 'Retro',
+    'Sports', 'Relaxing', 'Horror', 'Co-op', 'Free to Play', 'Female Protagonist', 'Sci-fi', 'Difficult',
+    'Third Person', 'Survival', 'Open World', 'Online PvP', 'PvP', 'Stats', 'Cartoony', 'Remote Play Together',
+    'Racing', 'Steam Leaderboards', 'Anime', 'Visual Novel', 'Physics', 'Roguelike', 'Roguelite', 'Puzzle Platformer',
+    'Point & Click', 'Sandbox', 'Turn-Based', 'Top-Down', 'Hand-drawn', 'Shared/Split Screen', 'Dark', 'Minimalist',
+    'Music', 'Mystery', 'Stylized', 'Comedy', 'Choices Matter', 'Tactical', 'Building', 'Management', 'Crafting',
+    'Bullet Hell', 'Card Game', 'Deckbuilding', 'Metroidvania', 'Hack and Slash', 'Stealth', 'Zombies', 'Space',
+    'Medieval', 'Cyberpunk', 'Post-apocalyptic', 'Military', 'Tower Defense', 'City Builder', 'Farming Sim',
+    'Dating Sim', 'Rhythm', 'Fighting', 'Beat em up', 'MMO', 'Battle Royale', 'Soulslike', 'Immersive Sim',
+    'Walking Simulator', 'Psychological Horror', 'Dungeon Crawler', 'Grand Strategy', 'Real Time Tactics', 'VR Only',
+    'In-App Purchases', 'Captions available', 'Includes level editor', 'Steam Workshop', 'LAN Co-op', 'Online Co-op',
+    'Cross-Platform Multiplayer', 'Tracked Controller Support', 'Lore-Rich', 'Nonlinear', 'Procedural Generation',
+    'Time Management', 'Economy', 'Trading', 'Resource Management', 'Base Building', 'Automation', 'Colony Sim',
+    'Driving', 'Flight', 'Naval', 'Trains', 'Fishing', 'Hunting', 'Cooking', 'Education', 'Word Game', 'Trivia',
+]
+
+QUERY_SIZES = (1, 2, 3)
+
+
+def make_synthetic_catalog(n_games, seed=0):
+    '''Synthetic catalog with the rec_allgames.csv columns'''
+    rng = np.random.default_rng(seed)
+
+    popularity = 1 / np.arange(1, len(TAGS) + 1) ** 0.8
+    popularity /= popularity.sum()
+    tags = np.array(TAGS, dtype=object)
+    n_tags = rng.integers(4, 21, n_games)
+    combined_info = [','.join(tags[rng.choice(len(TAGS), k, replace=False, p=popularity)]).replace('-', ' ')
+                     for k in n_tags]
+
+    app_ids = np.sort(rng.choice(np.arange(10, max(4_000_000, 4 * n_games)), n_games, replace=False))
+    positive = rng.pareto(1.2, n_games) * 20
+    negative = positive * rng.beta(2, 6, n_games)
+    total = positive + negative
+    z = 1.96
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phat = positive / total
+        wilson = (phat + z * z / (2 * total) - z * np.sqrt((phat * (1 - phat) + z * z / (4 * total)) / total)) / (1 + z * z / total)
+
+    return pd.DataFrame({
+        'AppID': app_ids,
+        'Name': [f"Game {i} {name}" for i, name in enumerate(tags[rng.integers(0, len(TAGS), n_games)])],
+        'Achievements': np.where(rng.random(n_games) < 0.55, rng.integers(1, 80, n_games), 0),
+        'combined_info': combined_info,
+        'Price': rng.choice([0, 0.99, 1.99, 4.99, 9.99, 14.99, 19.99, 29.99, 59.99, 69.99], n_games),
+        'Price_Range': '',
+        'dayssincereference': rng.integers(100, 10000, n_games),
+        'wilson_score': np.nan_to_num(wilson),
+        'Header image': [f"https://example.invalid/{app_id}/header.jpg" for app_id in app_ids],
+    })
+
+
+def build_synthetic_artifacts(n_games, out_dir, seed=0, compact=False):
+    '''Generates a catalog, fits the model on it and writes the artifacts (float32 / int32 matrices with compact)'''
+    from artifacts import write_artifacts
+    from catalogupdate import fit_model, recommendable
+    from recfunctions import compact_matrix, featurize
+    from sklearn.preprocessing import normalize
+
+    full_data = make_synthetic_catalog(n_games, seed)
+    rec_data = recommendable(full_data).sort_values('AppID').reset_index(drop=True)
+    vectorizer, scaler, scaler1, weighted_features = fit_model(full_data, rec_data)
+    full_features = featurize(full_data, vectorizer, scaler, scaler1)
+    matrices = (weighted_features, full_features, normalize(weighted_features))
+    if compact:
+        matrices = [compact_matrix(matrix) for matrix in matrices]
+    write_artifacts(out_dir, full_data, rec_data, scaler, scaler1, vectorizer, *matrices)
+
+
+def percentiles(seconds):
+    values = np.asarray(seconds) * 1000
+    return {'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99)), 'mean_ms': float(values.mean()), 'count': len(values)}
+
+
+def timed(function, calls):
+    seconds = []
+    for args, kwargs in calls:
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+    return percentiles(seconds)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_worker(artifact_dir, queries, seed=1, with_stats=False, compact=False, workers=0):
+    '''Measurements inside a fresh process so startup and RSS aren't polluted by the catalog generation'''
+    start = time.perf_counter()
+    from recfunctions import RecommenderEngine
+    from stats import Stats
+    engine = RecommenderEngine(artifact_dir=artifact_dir, stats=Stats(enabled=with_stats), compact=compact,
+                               workers=workers).warm()
+    startup = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    full_data = engine.full_data
+    app_ids = full_data['AppID'].values
+    names = full_data['Name'].values
+    selections = [list(rng.choice(app_ids, rng.choice(QUERY_SIZES), replace=False)) for _ in range(queries)]
+    filters = [{'max_price': float(rng.choice([5, 10, 20, 30])), 'min_wilson_score': float(rng.choice([0.3, 0.5, 0.7]))}
+               for _ in range(queries)]
+
+    # Warm up caches and lazy imports before measuring
+    engine.get_recommendations(selections[0])
+    engine.stats.reset()
+
+    results = {
+        'startup_s': startup,
+        'catalog_games': len(full_data),
+        'rec_games': len(engine.rec_data),
+        'get_game_id_by_id': timed(engine.get_game_id, [((int(app_id),), {}) for app_id in rng.choice(app_ids, queries)]),
+        'get_game_id_by_name': timed(engine.get_game_id, [((name,), {}) for name in rng.choice(names, queries)]),
+        'preprocess_user_input': timed(engine.preprocess_user_input, [((games,), {}) for games in selections]),
+        'get_recommendations': timed(engine.get_recommendations, [((games,), {'n': 10}) for games in selections]),
+        'get_recommendations_filtered': timed(engine.get_recommendations,
+                                              [((games,), {'n': 10, **f}) for games, f in zip(selections, filters)]),
+    }
+    results['peak_rss_mb'] = peak_rss_mb()
+    if with_stats:
+        results['stages'] = engine.stats.snapshot()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, queries=200, seed=0, keep_dir=None, with_stats=False, compact=False, workers=0):
+    report = {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'queries': queries,
+        'compact': compact,
+        'workers': workers,
+        'sizes': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_games in sizes:
+            artifact_dir = os.path.join(keep_dir or tmp, f"synthetic_{n_games}")
+            start = time.perf_counter()
+            build_synthetic_artifacts(n_games, artifact_dir, seed, compact)
+            build_seconds = time.perf_counter() - start
+
+            worker = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', artifact_dir,
+                                     '--queries', str(queries)] + (['--stats'] if with_stats else [])
+                                    + (['--compact'] if compact else []) + ['--workers', str(workers)],
+                                    capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            results = json.loads(worker.stdout.strip().splitlines()[-1])
+            results['build_s'] = build_seconds
+            report['sizes'][str(n_games)] = results
+
+            print(f"{n_games} games: startup {results['startup_s']:.2f}s, "
+                  f"recommendations p50 {results['get_recommendations']['p50_ms']:.2f}ms "
+                  f"p99 {results['get_recommendations']['p99_ms']:.2f}ms, peak RSS {results['peak_rss_mb']:.0f}MB")
+
+    return report
+
+
+def compare(old_path, new_path):
+    '''Prints new/old ratios of every timing that is in both result files (> 1 means slower)'''
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for size in new['sizes']:
+        if size not in old['sizes']:
+            continue
+        print(f"{size} games")
+        before, after = old['sizes'][size], new['sizes'][size]
+        for key, value in after.items():
+            if key not in before:
+                continue
+            if isinstance(value, dict):
+                old_value, new_value = before[key]['p50_ms'], value['p50_ms']
+                label = f"{key} p50"
+            elif isinstance(value, float):
+                old_value, new_value = before[key], value
+                label = key
+            else:
+                continue
+            ratio = new_value / old_value if old_value else float('nan')
+            print(f"  {label:40s} {old_value:10.3f} {new_value:10.3f}  x{ratio:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the recommender on synthetic catalogs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='catalog sizes to test')
+    parser.add_argument('--queries', type=int, default=200, help='queries per measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--keep-artifacts', default=None, help='keep the synthetic artifacts in this directory')
+    parser.add_argument('--compact', action='store_true', help='score with float32 / int32 matrices')
+    parser.add_argument('--workers', type=int, default=0, help='score on this many processes')
+    parser.add_argument('--stats', action='store_true', help='also record the per-stage timings of stats.py')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--worker', metavar='ARTIFACT_DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.queries, with_stats=args.stats, compact=args.compact,
+                                    workers=args.workers)))
+    elif args.compare:
+        compare(*args.compare)
+    else:
+        report = run_benchmarks(args.sizes, args.queries, args.seed, args.keep_artifacts, args.stats, args.compact,
+                                args.workers)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Results written to {args.out}")
@@ -0,0 +1,145 @@
+'''
+Builds rec_allgames.csv and rec_data.csv from the Kaggle games.csv dump (the steps of datacleaning.ipynb as a script).
+
+The source is streamed in chunks with only the columns we use and explicit dtypes, and every step is a vectorized
+pandas/NumPy operation, so memory is bounded by the cleaned output instead of the full dump with its descriptions.
+
+Usage:
+python builddata.py --source Data/games.csv --out-dir Data
+'''
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['AppID', 'Name', 'Release date', 'Price', 'Achievements', 'Positive', 'Negative', 'Developers', 'Publishers',
+           'Categories', 'Genres', 'Tags', 'Header image']
+
+DTYPES = {
+    'AppID': 'int64',
+    'Name': 'object',
+    'Release date': 'object',
+    'Price': 'float64',
+    'Achievements': 'float64',
+    'Positive': 'float64',
+    'Negative': 'float64',
+    'Developers': 'object',
+    'Publishers': 'object',
+    'Categories': 'object',
+    'Genres': 'object',
+    'Tags': 'object',
+    'Header image': 'object',
+}
+
+OUTPUT_COLUMNS = ['AppID', 'Name', 'Achievements', 'combined_info', 'Price', 'Price_Range', 'dayssincereference',
+                  'wilson_score', 'Header image']
+
+REFERENCE_DATE = pd.Timestamp('1997-06-29')
+
+PRICE_BIN_EDGES = [-0.01, 0.99, 5, 10, 20, 40, 60, 70, 1000]
+PRICE_BIN_LABELS = ['Free to Under $1', '$1 to $5', '$5 to $10', '$10 to $20', '$20 to $40', '$40 to $60', '$60 to $70',
+                    '$70+']
+
+EMOJI_PATTERN = '[\U00010000-\U0010ffff]|[\u2600-\u26FF]|[\u2700-\u27BF]|[\u2300-\u23FF]|[\u2B50]|[\u20E3]'
+
+
+def source_columns(path):
+    '''
+    Column names of games.csv. The Kaggle header merges "Discount" and "DLC count" into one "DiscountDLC count"
+    name, so it is one name short of the data (datacleaning.ipynb fixed this by shifting the columns).
+    '''
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    if 'DiscountDLC count' in header:
+        position = header.index('DiscountDLC count')
+        header[position:position + 1] = ['Discount', 'DLC count']
+    return header
+
+
+def wilson_score(positive, negative, z=1.96):
+    '''
+    Lower bound of the Wilson score interval of the positive review rate.
+    Games without positive reviews get exactly 0 (the formula gives 0 plus rounding noise there).
+    '''
+    n = positive + negative
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phat = positive / n
+        rate = (phat + z * z / (2 * n) - z * np.sqrt((phat * (1 - phat) + z * z / (4 * n)) / n)) / (1 + z * z / n)
+    return np.where(positive > 0, rate, 0.0)
+
+
+def clean_chunk(chunk):
+    '''Row-local cleaning of one chunk of games.csv'''
+    chunk = chunk.dropna(subset=['Name'])
+
+    positive = chunk['Positive'].fillna(0).to_numpy()
+    negative = chunk['Negative'].fillna(0).to_numpy()
+    chunk = chunk.assign(wilson_score=wilson_score(positive, negative))
+
+    # Remove all games with 0 reviews and no tags
+    chunk = chunk[~((chunk['wilson_score'] == 0) & chunk['Tags'].isna())]
+
+    # Remove games where tags, categories and genres are all missing
+    info = chunk[['Categories', 'Genres', 'Tags']]
+    chunk = chunk[info.notna().any(axis=1)]
+    info = info.loc[chunk.index]
+
+    # Combined information from categories, genres and tags, without the empty parts
+    combined_info = info['Categories'].fillna('') + ',' + info['Genres'].fillna('') + ',' + info['Tags'].fillna('')
+    combined_info = combined_info.str.replace(r',{2,}', ',', regex=True).str.strip(',').str.strip()
+    combined_info = combined_info.str.replace('-', ' ', regex=False)
+
+    release_date = pd.to_datetime(chunk['Release date'], format='mixed', errors='coerce')
+
+    return chunk.assign(
+        combined_info=combined_info,
+        Price_Range=pd.cut(chunk['Price'], bins=PRICE_BIN_EDGES, labels=PRICE_BIN_LABELS),
+        dayssincereference=(release_date - REFERENCE_DATE).dt.days,
+        Achievements=chunk['Achievements'].fillna(0).astype('int64'),
+    )
+
+
+def build_catalog(source, chunk_size=20000):
+    '''
+    Streams games.csv and returns (all_games, rec_data):
+    - all_games: every cleaned game, the rec_allgames.csv table
+    - rec_data: the games to recommend from (achievements and wilson score > 0.2), sorted by AppID
+    '''
+    reader = pd.read_csv(source, header=0, names=source_columns(source), usecols=COLUMNS, dtype=DTYPES,
+                         chunksize=chunk_size)
+    cleaned = pd.concat([clean_chunk(chunk) for chunk in reader], ignore_index=True)
+
+    # Remove duplicates if name and developers and publishers are the same, then order by them
+    # (games missing a developer or publisher are dropped, like the groupby in datacleaning.ipynb did)
+    keys = ['Name', 'Developers', 'Publishers']
+    cleaned = cleaned.drop_duplicates(subset=keys, keep='first').dropna(subset=keys)
+    cleaned = cleaned.sort_values(keys, kind='stable')
+
+    cleaned['Name'] = cleaned['Name'].str.replace(EMOJI_PATTERN, '', regex=True)
+
+    all_games = cleaned[OUTPUT_COLUMNS].reset_index(drop=True)
+    rec_data = all_games[(all_games['Achievements'] > 0) & (all_games['wilson_score'] > 0.2)]
+    rec_data = rec_data.sort_values(by='AppID', kind='stable').reset_index(drop=True)
+    return all_games, rec_data
+
+
+def write_catalog(all_games, rec_data, out_dir='Data'):
+    os.makedirs(out_dir, exist_ok=True)
+    all_games.to_csv(os.path.join(out_dir, 'rec_allgames.csv'), index=False)
+    rec_data.to_csv(os.path.join(out_dir, 'rec_data.csv'), index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build rec_allgames.csv and rec_data.csv from the Kaggle games.csv')
+    parser.add_argument('--source', default='Data/games.csv')
+    parser.add_argument('--out-dir', default='Data')
+    parser.add_argument('--chunk-size', type=int, default=20000, help='rows of games.csv read at once')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    all_games, rec_data = build_catalog(args.source, args.chunk_size)
+    write_catalog(all_games, rec_data, args.out_dir)
+    print(all_games.shape[0], 'Games in total')
+    print(rec_data.shape[0], 'Games in recommendation data')
+    print(f"Built in {time.perf_counter() - start:.1f}s")
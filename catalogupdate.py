@@ -0,0 +1,206 @@
+'''
+Incremental catalog updates: new or changed games are featurized with the existing vocabulary and scalers and their
+rows are replaced or appended in the catalog and feature matrices, instead of refitting everything like
+MatrixCalc.ipynb does.
+
+A full refit only happens when the new games drift too far from the fitted model:
+- too many of their tokens are not in the TF-IDF vocabulary
+- too many of the recommendable ones have a price, release date or wilson score outside the scaler ranges
+
+Usage (changes.csv has the rec_allgames.csv columns, e.g. the output of builddata.py for a new dump;
+rows that are the same as the current catalog are skipped):
+python catalogupdate.py --changes changes.csv --artifacts Artifacts
+'''
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import MinMaxScaler, normalize
+
+from artifacts import load_artifacts, write_artifacts
+from recfunctions import compact_matrix, featurize, numeric_weight, numeric_weight1
+
+NUMERIC_COLUMNS = ['Price', 'dayssincereference']
+NUMERIC_COLUMNS1 = ['wilson_score']
+
+
+def recommendable(data):
+    '''Games to recommend from (same rule as datacleaning.ipynb: achievements and wilson score > 0.2)'''
+    return data[(data['Achievements'] > 0) & (data['wilson_score'] > 0.2)]
+
+
+def fit_model(full_data, rec_data):
+    '''
+    Fits the vectorizer and scalers and builds the weighted feature matrix, the same as MatrixCalc.ipynb
+
+    output:
+    vectorizer, scaler, scaler1, weighted_features
+    '''
+    vectorizer = TfidfVectorizer()
+    vectorizer.fit(full_data['combined_info'].fillna(''))
+
+    scaler = MinMaxScaler()
+    scaler.fit(rec_data[NUMERIC_COLUMNS].values)
+
+    scaler1 = MinMaxScaler()
+    scaler1.fit(rec_data[NUMERIC_COLUMNS1].values)
+
+    weighted_features = featurize(rec_data, vectorizer, scaler, scaler1, numeric_weight, numeric_weight1)
+    return vectorizer, scaler, scaler1, weighted_features
+
+
+def changed_rows(full_data, candidates):
+    '''Rows of candidates that are new or differ from the game with the same AppID in full_data'''
+    old = full_data.set_index('AppID')
+    candidates = candidates.drop_duplicates(subset='AppID', keep='last')
+    known = candidates['AppID'].isin(old.index).values
+
+    changed = ~known
+    existing = old.loc[candidates['AppID'].values[known]]
+    for column in candidates.columns:
+        if column == 'AppID' or column not in old.columns:
+            continue
+        new_values = candidates[column].values[known]
+        old_values = existing[column].values
+        same = (new_values == old_values) | (pd.isna(new_values) & pd.isna(old_values))
+        changed[np.flatnonzero(known)[~same]] = True
+
+    return candidates[changed]
+
+
+def drift_report(changes, vectorizer, scaler, scaler1):
+    '''
+    How far the changed games are from the fitted model:
+    - oov_rate: share of their tokens that are not in the vocabulary
+    - range_violation_rate: share of the recommendable ones with a numeric value outside the scaler ranges
+    '''
+    analyzer = vectorizer.build_analyzer()
+    tokens = unknown = 0
+    for text in changes['combined_info'].fillna(''):
+        words = analyzer(text)
+        tokens += len(words)
+        unknown += sum(word not in vectorizer.vocabulary_ for word in words)
+
+    rec_changes = recommendable(changes)
+    outside = np.zeros(len(rec_changes), dtype=bool)
+    for columns, fitted in ((NUMERIC_COLUMNS, scaler), (NUMERIC_COLUMNS1, scaler1)):
+        values = rec_changes[columns].values
+        outside |= ((values < fitted.data_min_) | (values > fitted.data_max_)).any(axis=1)
+
+    return {
+        'changed_games': len(changes),
+        'oov_rate': unknown / tokens if tokens else 0.0,
+        'range_violation_rate': float(outside.mean()) if len(outside) else 0.0,
+    }
+
+
+def _replace_rows(data, matrix, changes, change_matrix):
+    '''
+    Replaces the rows of the games in changes (by AppID) and appends the new ones.
+    Returns the new dataframe and the matrix rows in the same order.
+    '''
+    change_rows = pd.Series(np.arange(len(changes)), index=changes['AppID'].values)
+    replaced = data['AppID'].isin(change_rows.index).values
+
+    # Rows of vstack([matrix, change_matrix]) in the order of the new dataframe
+    source = np.arange(len(data))
+    source[replaced] = len(data) + change_rows.loc[data['AppID'].values[replaced]].values
+    appended = ~changes['AppID'].isin(data['AppID']).values
+    source = np.concatenate([source, len(data) + np.flatnonzero(appended)])
+
+    updated = data.copy()
+    new_values = changes.set_index('AppID').loc[data['AppID'].values[replaced]]
+    for column in new_values.columns:
+        updated.loc[replaced, column] = new_values[column].values
+    updated = pd.concat([updated, changes[appended]], ignore_index=True)
+
+    return updated, vstack([matrix, change_matrix], format='csr')[source]
+
+
+def update_catalog(artifact_dir, changes, out_dir=None, max_oov_rate=0.05, max_range_violation_rate=0.01,
+                   force_refit=False):
+    '''
+    Applies new or changed games to an artifact set and writes the result as a new version into out_dir
+    (artifact_dir by default, see artifacts.write_artifacts). A running RecommenderEngine picks it up with
+    engine.reload(), it can keep serving the old version until then.
+
+    Parameters:
+    - artifact_dir: current artifacts (python artifacts.py export)
+    - changes: dataframe with the rec_allgames.csv columns, rows identical to the current catalog are skipped
+    - max_oov_rate: refit when more of the changed games' tokens than this are missing from the vocabulary
+    - max_range_violation_rate: refit when more of the changed recommendable games than this fall outside
+      the scaler ranges
+    - force_refit: always refit
+
+    output:
+    dict with the drift numbers and whether the model was refit.
+    The files built offline from the feature matrices (neighbors.npz, rec_neighbors.npz, embedding.npz) carry the
+    fingerprint of the old ones, the engine refuses them after an update until they are rebuilt with neighbors.py
+    and embedding.py.
+    '''
+    out_dir = out_dir or artifact_dir
+    # Read into memory, so nothing of the current version stays mapped while the new one replaces it
+    artifacts = load_artifacts(artifact_dir, include_text=True, mmap=False)
+    full_data, rec_data = artifacts['full_data'], artifacts['rec_data']
+    vectorizer, scaler, scaler1 = artifacts['vectorizer'], artifacts['scaler'], artifacts['scaler1']
+
+    changes = changed_rows(full_data, changes[full_data.columns.intersection(changes.columns)])
+    report = drift_report(changes, vectorizer, scaler, scaler1)
+    report['refit'] = bool(force_refit or report['oov_rate'] > max_oov_rate
+                           or report['range_violation_rate'] > max_range_violation_rate)
+    if not len(changes) and not force_refit:
+        return report
+
+    # Catalog of every game with the changes applied
+    full_data, full_features = _replace_rows(full_data, artifacts['full_features'], changes,
+                                             featurize(changes, vectorizer, scaler, scaler1))
+
+    # Games to recommend from: drop the changed ones and add back the ones that are still recommendable
+    rec_changes = recommendable(changes)
+    kept = ~rec_data['AppID'].isin(changes['AppID']).values
+    rec_data_updated = pd.concat([rec_data[kept], rec_changes], ignore_index=True)
+    order = np.argsort(rec_data_updated['AppID'].values, kind='stable')
+    rec_data_updated = rec_data_updated.iloc[order].reset_index(drop=True)
+
+    if report['refit']:
+        vectorizer, scaler, scaler1, weighted_features = fit_model(full_data, rec_data_updated)
+        full_features = featurize(full_data, vectorizer, scaler, scaler1)
+        normalized_features = normalize(weighted_features)
+    else:
+        # Only the changed rows get featurized, the others are taken from the current matrices
+        rec_weighted = featurize(rec_changes, vectorizer, scaler, scaler1, numeric_weight, numeric_weight1)
+        weighted_features = vstack([artifacts['weighted_features'][np.flatnonzero(kept)], rec_weighted], format='csr')[order]
+        normalized_features = vstack([artifacts['normalized_features'][np.flatnonzero(kept)], normalize(rec_weighted)],
+                                     format='csr')[order]
+
+    # Compact artifact sets stay compact
+    if artifacts['normalized_features'].dtype == np.float32:
+        weighted_features, full_features, normalized_features = (
+            compact_matrix(matrix) for matrix in (weighted_features, full_features, normalized_features))
+
+    # Still made from the same exported files, only the changes were applied on top
+    write_artifacts(out_dir, full_data, rec_data_updated, scaler, scaler1, vectorizer, weighted_features, full_features,
+                    normalized_features, artifacts['manifest'].get('sources'))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply new or changed games to the artifacts without a full refit')
+    parser.add_argument('--changes', required=True, help='CSV with the rec_allgames.csv columns')
+    parser.add_argument('--artifacts', default='Artifacts')
+    parser.add_argument('--out', default=None, help='write the updated artifacts here instead of in place')
+    parser.add_argument('--max-oov-rate', type=float, default=0.05)
+    parser.add_argument('--max-range-violation-rate', type=float, default=0.01)
+    parser.add_argument('--force-refit', action='store_true')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = update_catalog(args.artifacts, pd.read_csv(args.changes), args.out, args.max_oov_rate,
+                            args.max_range_violation_rate, args.force_refit)
+    print(report)
+    print("Rebuild neighbors.npz, rec_neighbors.npz and embedding.npz (neighbors.py, embedding.py), "
+          "the engine refuses the old ones")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,128 @@
+'''
+Offline build of a dense low dimensional embedding of the rec_data games for the 'svd' scoring mode.
+
+TruncatedSVD projects weighted_features (tfidf of combined_info plus the weighted scaled numeric columns) onto its
+top dims components. The engine keeps the components (dims x features) and the L2 normalized projection of every
+rec_data game (rec_data x dims), both float32, and scores a query with one dense mat-vec on that small matrix.
+The scores approximate the exact cosine similarities, --report measures how often the top n stays the same.
+
+Usage:
+python embedding.py --dims 128 --out Stuff/embedding.npz
+python embedding.py --report 64 128 256 --n 10 --queries 200
+'''
+import argparse
+import time
+
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+
+def fit_embedding(weighted_features, dims=128, seed=0):
+    '''
+    Fits the projection on the rec_data feature rows
+
+    output:
+    (components, embedding): dims x features and rows x dims float32 arrays, the embedding rows L2 normalized
+    '''
+    dims = min(dims, min(weighted_features.shape) - 1)
+    svd = TruncatedSVD(n_components=dims, algorithm='randomized', random_state=seed)
+    projected = svd.fit_transform(weighted_features.astype(np.float64))
+
+    components = np.ascontiguousarray(svd.components_, dtype=np.float32)
+    embedding = np.ascontiguousarray(normalize(projected), dtype=np.float32)
+    return components, embedding
+
+
+def project(components, user_vector):
+    '''Dense query vector of a normalized sparse user row (full_features layout) in the embedding space'''
+    user_vector = user_vector.tocsr()
+    return components[:, user_vector.indices] @ user_vector.data.astype(np.float32)
+
+
+def save_embedding(path, app_ids, components, embedding, fingerprint=''):
+    '''Saves the embedding with the AppIDs of the rec_data rows and the fingerprint of the feature matrices it was built for'''
+    np.savez(path, app_ids=np.asarray(app_ids, dtype=np.int32), components=components, embedding=embedding,
+             fingerprint=np.array(fingerprint))
+
+
+def load_embedding(path):
+    '''Loads an embedding saved by save_embedding as a dict of arrays'''
+    with np.load(path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def build_embedding(dims=128, out='Stuff/embedding.npz', seed=0):
+    '''Fits and saves the embedding of the rec_data games of the shared engine'''
+    import recfunctions as rec
+
+    state = rec.engine.state
+    components, embedding = fit_embedding(state.weighted_features, dims, seed)
+    save_embedding(out, state.rec_data['AppID'].values, components, embedding, state.fingerprint)
+
+
+def recall_report(dims_list=(64, 128, 256), n=10, queries=200, seed=0):
+    '''
+    recall@n of the svd mode against the exact scores for every number of dims: the share of the exact top n
+    (no filters) that the svd top n finds, over random selections of 1 to 3 rec_data games.
+    Also gives the mean scoring time of both and the size of the embedding.
+    '''
+    import recfunctions as rec
+
+    engine = rec.engine
+    state = engine.state
+    rng = np.random.default_rng(seed)
+    app_ids = state.rec_data['AppID'].values
+    selections = [[int(game) for game in rng.choice(app_ids, rng.integers(1, 4), replace=False)] for _ in range(queries)]
+
+    user_rows = [normalize(engine.preprocess_user_input(games, state)) for games in selections]
+    user_vectors = [user_row.toarray().ravel().astype(state.dtype, copy=False) for user_row in user_rows]
+
+    # Exact top n of every selection once
+    exact = []
+    start = time.perf_counter()
+    for games, user_vector in zip(selections, user_vectors):
+        scores = state.normalized_features @ user_vector
+        candidates = np.flatnonzero(state.rec_filters.mask(exclude_ids=games))
+        exact.append(set(rec.top_n_indices(scores, candidates, n).tolist()))
+    exact_ms = (time.perf_counter() - start) / queries * 1000
+
+    report = []
+    for dims in dims_list:
+        fit_start = time.perf_counter()
+        components, embedding = fit_embedding(state.weighted_features, dims, seed)
+        fit_s = time.perf_counter() - fit_start
+
+        found = 0
+        start = time.perf_counter()
+        for games, user_row, exact_top in zip(selections, user_rows, exact):
+            scores = embedding @ project(components, user_row)
+            candidates = np.flatnonzero(state.rec_filters.mask(exclude_ids=games))
+            found += len(exact_top & set(rec.top_n_indices(scores, candidates, n).tolist()))
+        svd_ms = (time.perf_counter() - start) / queries * 1000
+
+        report.append({'dims': embedding.shape[1], f'recall@{n}': found / sum(len(top) for top in exact),
+                       'svd_ms': svd_ms, 'exact_ms': exact_ms, 'fit_s': fit_s,
+                       'mb': (components.nbytes + embedding.nbytes) / 2**20})
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the svd embedding of the rec_data games')
+    parser.add_argument('--dims', type=int, default=128, help='dimensions of the embedding')
+    parser.add_argument('--out', default='Stuff/embedding.npz')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', type=int, nargs='+', metavar='DIMS',
+                        help='only measure recall@n against the exact scores for these dims, nothing is saved')
+    parser.add_argument('--n', type=int, default=10, help='n of recall@n')
+    parser.add_argument('--queries', type=int, default=200, help='random selections measured')
+    args = parser.parse_args()
+
+    if args.report:
+        for row in recall_report(args.report, args.n, args.queries, args.seed):
+            print(f"dims {row['dims']:4d}  recall@{args.n} {row[f'recall@{args.n}']:.3f}  "
+                  f"svd {row['svd_ms']:.2f}ms  exact {row['exact_ms']:.2f}ms  fit {row['fit_s']:.1f}s  {row['mb']:.1f}MB")
+    else:
+        start = time.perf_counter()
+        build_embedding(args.dims, args.out, args.seed)
+        print(f"Saved the embedding to {args.out} in {time.perf_counter() - start:.1f}s")
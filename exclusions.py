@@ -0,0 +1,146 @@
+'''
+Games a user already owns or doesn't want recommended, saved between sessions.
+
+On disk an exclusion list is a small binary file: a header (magic, version, counts) followed by the sorted
+owned and blocked AppIDs as little-endian uint32, 4 bytes per game.
+
+For scoring the AppIDs get mapped once to a bitset over the rec_data rows (one bit per game), which
+get_recommendations applies as a mask, so a library of thousands of games costs the same per query as an empty one.
+'''
+import itertools
+import os
+import struct
+import threading
+import weakref
+
+import numpy as np
+
+MAGIC = b'SGRX'
+VERSION = 1
+HEADER = struct.Struct('<4sBII')
+
+OWNED = 'owned'
+BLOCKED = 'blocked'
+
+_ids = itertools.count()
+
+
+class ExclusionList:
+    '''
+    Owned and blocked AppIDs of one user.
+
+    key changes with every edit, the engine uses it to tell cached results of an older version apart.
+    '''
+
+    def __init__(self, owned=(), blocked=(), path=None):
+        self.owned = {int(app_id) for app_id in owned}
+        self.blocked = {int(app_id) for app_id in blocked} - self.owned
+        self.path = path
+        self._id = next(_ids)
+        self._version = 0
+        self._bitset = None         # (weakref to the FilterIndex, version, packed bits)
+        self._lock = threading.Lock()
+
+    @property
+    def key(self):
+        return (self._id, self._version)
+
+    def __len__(self):
+        return len(self.owned) + len(self.blocked)
+
+    def __contains__(self, app_id):
+        return int(app_id) in self.owned or int(app_id) in self.blocked
+
+    def app_ids(self):
+        return self.owned | self.blocked
+
+    def add(self, app_id, kind=OWNED):
+        '''Adds the game as owned or blocked (moving it from the other list if it was there)'''
+        app_id = int(app_id)
+        target, other = (self.owned, self.blocked) if kind == OWNED else (self.blocked, self.owned)
+        with self._lock:
+            other.discard(app_id)
+            target.add(app_id)
+            self._version += 1
+
+    def remove(self, app_id):
+        app_id = int(app_id)
+        with self._lock:
+            self.owned.discard(app_id)
+            self.blocked.discard(app_id)
+            self._version += 1
+
+    def kind(self, app_id):
+        '''OWNED, BLOCKED or None'''
+        app_id = int(app_id)
+        if app_id in self.owned:
+            return OWNED
+        if app_id in self.blocked:
+            return BLOCKED
+        return None
+
+    def bitset(self, filters):
+        '''
+        Packed bitset over the rows of filters (a FilterIndex, rec_data for the engine) with the excluded games set.
+        Built once per version and filter index.
+        '''
+        with self._lock:
+            cached = self._bitset
+            if cached is not None and cached[0]() is filters and cached[1] == self._version:
+                return cached[2]
+
+            rows = filters.rows_of(np.fromiter(self.app_ids(), dtype=np.int64))
+            bits = np.zeros(filters.size, dtype=bool)
+            bits[rows] = True
+            packed = np.packbits(bits)
+            self._bitset = (weakref.ref(filters), self._version, packed)
+            return packed
+
+    def mask(self, filters):
+        '''Boolean mask over the rows of filters, True for the games that are excluded'''
+        return np.unpackbits(self.bitset(filters), count=filters.size).view(bool)
+
+    def excluded(self, filters, rows):
+        '''Whether each of the given rows of filters is excluded, read straight from the bitset'''
+        rows = np.asarray(rows, dtype=np.intp)
+        return ((self.bitset(filters)[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the exclusion list to")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        owned = np.array(sorted(self.owned), dtype='<u4')
+        blocked = np.array(sorted(self.blocked), dtype='<u4')
+        # Written under a temporary name first so a crash never leaves half a file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(owned), len(blocked)))
+            f.write(owned.tobytes())
+            f.write(blocked.tobytes())
+        os.replace(tmp_path, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Reads a saved list, an empty list if the file doesn't exist yet.
+        A truncated or corrupt file is kept as path.bak and an empty list is returned, so it never stops the app.
+        '''
+        if not os.path.exists(path):
+            return cls(path=path)
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            magic, version, n_owned, n_blocked = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("not an exclusion list (or written by a newer version)")
+            ids = np.frombuffer(data, dtype='<u4', count=n_owned + n_blocked, offset=HEADER.size)
+        except (struct.error, ValueError) as e:
+            backup = f"{path}.bak"
+            print(f"Could not read the exclusion list {path} ({e}), starting with an empty one, the file was kept as {backup}")
+            os.replace(path, backup)
+            return cls(path=path)
+        return cls(ids[:n_owned].tolist(), ids[n_owned:].tolist(), path=path)
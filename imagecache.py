@@ -0,0 +1,239 @@
+'''
+Cache of the resized Steam header images shown by the Application.
+
+Two tiers:
+- memory: LRU of the resized PIL images
+- disk: one JPEG per thumbnail in cache_dir, named after the AppID and a hash of the URL,
+  the least recently used files are deleted once the directory goes over max_disk_bytes
+
+A repeat view costs no download and no decode/resize.
+
+ImageFetcher runs the cache on a thread pool so downloads never block the Tk main loop.
+'''
+import hashlib
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+from stats import Stats
+
+THUMBNAIL_SIZE = (300, 140)
+
+
+class ThumbnailCache:
+    '''
+    Parameters:
+    - cache_dir: directory of the disk tier
+    - max_memory_items: number of thumbnails kept in memory
+    - max_disk_bytes: size the disk tier is trimmed back to
+    - size: thumbnail size
+    - session: requests.Session used to download (optional, plain requests.get otherwise)
+    - timeout: download timeout in seconds
+    - stats: Stats object the hits, misses and download times are recorded into (optional)
+    '''
+
+    def __init__(self, cache_dir='Cache/thumbnails', max_memory_items=256, max_disk_bytes=200 * 1024 * 1024,
+                 size=THUMBNAIL_SIZE, session=None, timeout=10, stats=None):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.size = size
+        self.session = session
+        self.timeout = timeout
+        self.stats = stats or Stats()
+
+        self.hits = 0           # served from memory
+        self.disk_hits = 0      # served from disk
+        self.misses = 0         # downloaded
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    def _path(self, app_id, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{int(app_id)}_{digest}.jpg")
+
+    def _remember(self, key, image):
+        with self._lock:
+            self._memory[key] = image
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def peek(self, app_id, url):
+        '''Returns the thumbnail if it is in the memory tier, None otherwise (never touches disk or network)'''
+        key = (int(app_id), url)
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+        if image is not None:
+            self.stats.count('thumbnails.memory_hit')
+        return image
+
+    def get(self, app_id, url):
+        '''
+        Returns the thumbnail of the game's header image as a PIL image,
+        from memory, then disk, and downloads and resizes it if it isn't cached
+        '''
+        key = (int(app_id), url)
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+        if image is not None:
+            self.stats.count('thumbnails.memory_hit')
+            return image
+
+        path = self._path(app_id, url)
+        try:
+            image = Image.open(path)
+            image.load()
+            os.utime(path)      # mark as recently used for the eviction
+            self.disk_hits += 1
+            self.stats.count('thumbnails.disk_hit')
+        except (OSError, ValueError):
+            with self.stats.timer('thumbnails.download'):
+                image = self._download(url)
+            self._store(path, image)
+            self.misses += 1
+            self.stats.count('thumbnails.miss')
+
+        self._remember(key, image)
+        return image
+
+    def _download(self, url):
+        response = (self.session or requests).get(url, timeout=self.timeout)
+        response.raise_for_status()
+        image = Image.open(BytesIO(response.content))
+        return image.convert('RGB').resize(self.size, Image.Resampling.LANCZOS)
+
+    def _store(self, path, image):
+        # Written under a temporary name first so a reader never opens half a file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, format='JPEG', quality=90)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path)
+            over_limit = self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        '''Deletes the least recently used thumbnails until the disk tier is under 90% of max_disk_bytes'''
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.jpg'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_disk_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+
+def make_session(pool_size=8):
+    '''requests.Session with a keep-alive connection pool big enough for every fetch thread'''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ImageFetcher:
+    '''
+    Gets thumbnails from a ThumbnailCache on a thread pool and hands them back on the Tk main loop.
+
+    Fetches belong to a group (e.g. 'preview', 'selected', 'recommendations'). new_batch(group) cancels the
+    fetches of that group that haven't started and drops the results of the ones that have, so a slow download
+    for an old selection never overwrites a newer one.
+
+    Parameters:
+    - root: Tk root, results are delivered with root.after()
+    - cache: ThumbnailCache to fetch from
+    - max_workers: number of download threads
+    - poll_ms: how often the main loop picks up finished fetches
+    '''
+
+    def __init__(self, root, cache, max_workers=8, poll_ms=30):
+        self.root = root
+        self.cache = cache
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='thumbnails')
+        self._results = queue.SimpleQueue()
+        self._generations = {}
+        self._pending = {}
+        self.root.after(self.poll_ms, self._poll)
+
+    def new_batch(self, group):
+        '''Starts a new batch for the group, the older fetches of the group are cancelled or ignored'''
+        self._generations[group] = self._generations.get(group, 0) + 1
+        for future in self._pending.pop(group, []):
+            future.cancel()
+
+    def fetch(self, group, app_id, url, callback, error_callback=None):
+        '''
+        Gets the thumbnail and calls callback(image) on the Tk main loop,
+        or error_callback(exception) if it couldn't be loaded.
+        Thumbnails already in memory are handed over right away.
+        '''
+        image = self.cache.peek(app_id, url)
+        if image is not None:
+            callback(image)
+            return
+
+        generation = self._generations.setdefault(group, 0)
+        future = self._executor.submit(self._work, group, generation, app_id, url, callback, error_callback)
+        pending = self._pending.setdefault(group, [])
+        pending[:] = [f for f in pending if not f.done()]
+        pending.append(future)
+
+    def _work(self, group, generation, app_id, url, callback, error_callback):
+        # Checked again here so fetches from an old batch that already got a thread don't download anything
+        if self._generations.get(group) != generation:
+            return
+        try:
+            self._results.put((group, generation, callback, self.cache.get(app_id, url)))
+        except Exception as e:
+            self._results.put((group, generation, error_callback, e))
+
+    def _poll(self):
+        while True:
+            try:
+                group, generation, callback, result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if callback is not None and self._generations.get(group) == generation:
+                callback(result)
+        self.root.after(self.poll_ms, self._poll)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,100 @@
+'''
+Load test of service.py: many concurrent keep-alive clients asking for recommendations of random game selections.
+
+Reports throughput and latency p50/p95/p99. Run it against the service with and without batching
+(--batch-window-ms 0 --max-batch 1) to compare.
+
+Usage:
+python service.py --port 8080 &
+python loadtest.py --url http://127.0.0.1:8080 --clients 64 --requests 5000
+'''
+import argparse
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+
+def sample_app_ids(artifact_dir='Artifacts', data_dir='Data'):
+    '''AppIDs to build the random selections from (the artifacts if there are any, otherwise rec_allgames.csv)'''
+    from artifacts import current_artifacts, has_artifacts, read_manifest
+    if has_artifacts(artifact_dir):
+        artifact_dir = current_artifacts(artifact_dir)
+        spec = read_manifest(artifact_dir)['tables']['full_data']['columns']['AppID']
+        return np.load(os.path.join(artifact_dir, spec['file']))
+    import pandas as pd
+    return pd.read_csv(os.path.join(data_dir, 'rec_allgames.csv'), usecols=['AppID'])['AppID'].values
+
+
+async def client(host, port, bodies, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for body in bodies:
+            data = json.dumps(body).encode('utf-8')
+            start = time.perf_counter()
+            writer.write(f"POST /recommendations HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+            await writer.drain()
+
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run(url, clients, requests, app_ids, n=10, filter_share=0.5, seed=0):
+    parts = urlsplit(url)
+    rng = np.random.default_rng(seed)
+    bodies = []
+    for _ in range(requests):
+        body = {'games': [int(game) for game in rng.choice(app_ids, rng.integers(1, 4), replace=False)], 'n': n}
+        if rng.random() < filter_share:
+            body['max_price'] = float(rng.choice([5, 10, 20, 30]))
+            body['min_wilson_score'] = float(rng.choice([0.3, 0.5, 0.7]))
+        bodies.append(body)
+
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(parts.hostname, parts.port or 80, bodies[i::clients], latencies, errors)
+                           for i in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'seconds': elapsed,
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test the recommendation service')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--clients', type=int, default=64, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--artifacts', default='Artifacts', help='where to take the AppIDs from')
+    parser.add_argument('--data-dir', default='Data')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.url, args.clients, args.requests, sample_app_ids(args.artifacts, args.data_dir), args.n))
+    print(json.dumps(report, indent=1))
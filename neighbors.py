@@ -0,0 +1,119 @@
+'''
+Offline build of the item-item nearest neighbour lists for every game in rec_allgames.csv,
+and of the neighbour table of the rec_data games that answers 1 and 2 game queries (--rec).
+
+Similarities are computed a chunk of games at a time, so memory stays at about
+len(catalog) * chunk_size floats and the full similarity matrix is never built.
+
+Usage:
+python neighbors.py --k 100 --chunk-size 256 --out Stuff/neighbors.npz
+python neighbors.py --rec --k 100 --out Stuff/rec_neighbors.npz
+'''
+import argparse
+import time
+
+import numpy as np
+from sklearn.preprocessing import normalize
+
+
+def chunked_top_k(queries, items, k, chunk_size=256, exclude_self=False, dtype=np.float32):
+    '''
+    For every row of queries finds the k rows of items with the highest dot product
+    (cosine similarity when both are L2 normalized).
+    
+    Parameters:
+    - queries: sparse matrix, one query per row
+    - items: sparse matrix with the same columns as queries
+    - k: number of neighbours to keep per query
+    - chunk_size: number of queries scored at once, bounds memory to len(items) * chunk_size float32
+    - exclude_self: queries and items are the same rows, don't return a row as its own neighbour
+    - dtype: precision the similarities are computed in (the scores are stored as float32 either way)
+    
+    output:
+    (indices, scores) arrays of shape (n_queries, k), int32 and float32, best neighbour first (ties in row order)
+    '''
+    items = items.tocsr().astype(dtype)
+    queries = queries.tocsr().astype(dtype)
+    n_queries, n_items = queries.shape[0], items.shape[0]
+    k = min(k, n_items - 1 if exclude_self else n_items)
+    
+    indices = np.empty((n_queries, k), dtype=np.int32)
+    scores = np.empty((n_queries, k), dtype=np.float32)
+    
+    for start in range(0, n_queries, chunk_size):
+        stop = min(start + chunk_size, n_queries)
+        
+        # n_items x chunk block of similarities, sparse times dense is much faster than sparse times sparse here
+        block = items @ queries[start:stop].T.toarray()
+        if exclude_self:
+            block[np.arange(start, stop), np.arange(stop - start)] = -np.inf
+        
+        top = np.argpartition(block, n_items - k, axis=0)[n_items - k:]
+        top_scores = np.take_along_axis(block, top, axis=0)
+        order = np.lexsort((top, -top_scores), axis=0)
+        
+        indices[start:stop] = np.take_along_axis(top, order, axis=0).T
+        scores[start:stop] = np.take_along_axis(top_scores, order, axis=0).T
+    
+    return indices, scores
+
+
+def save_neighbors(path, app_ids, indices, scores, fingerprint=''):
+    '''
+    Saves the neighbour lists with the AppIDs of the rows they were built for and the fingerprint of the feature
+    matrices they were built from (EngineState.fingerprint), the engine refuses lists whose fingerprint doesn't match
+    '''
+    np.savez(path, app_ids=np.asarray(app_ids, dtype=np.int32), neighbors=indices, scores=scores,
+             fingerprint=np.array(fingerprint))
+
+
+def load_neighbors(path):
+    '''Loads neighbour lists saved by save_neighbors as a dict of arrays'''
+    with np.load(path) as lists:
+        return {name: lists[name] for name in lists.files}
+
+
+def build_rec_neighbors(k=100, chunk_size=256, out='Stuff/rec_neighbors.npz'):
+    '''
+    Builds and saves the top k rec_data games of every rec_data game as a 1 game query would score them:
+    the game's normalized full_features row against normalized_features, in the precision of the engine
+    '''
+    import recfunctions as rec
+    
+    state = rec.engine.state
+    full_rows = [state.catalog_index.row(app_id) for app_id in state.rec_data['AppID'].values]
+    queries = normalize(state.full_features[full_rows])
+    
+    indices, scores = chunked_top_k(queries, state.normalized_features, k, chunk_size=chunk_size, exclude_self=True,
+                                    dtype=state.dtype)
+    save_neighbors(out, state.rec_data['AppID'].values, indices, scores, state.fingerprint)
+
+
+def build_full_catalog_neighbors(k=100, chunk_size=256, out='Stuff/neighbors.npz'):
+    '''Builds and saves the top k neighbours of every game in full_data using the weighted feature rows'''
+    import recfunctions as rec
+    
+    state = rec.engine.state
+    features = normalize(rec.weight_columns(state.full_features))
+    
+    indices, scores = chunked_top_k(features, features, k, chunk_size=chunk_size, exclude_self=True)
+    save_neighbors(out, state.full_data['AppID'].values, indices, scores, state.fingerprint)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the item-item neighbour lists of the full catalog')
+    parser.add_argument('--k', type=int, default=100, help='neighbours to keep per game')
+    parser.add_argument('--chunk-size', type=int, default=256, help='games scored at once (bounds memory)')
+    parser.add_argument('--rec', action='store_true',
+                        help='build the rec_data table get_recommendations answers 1 and 2 game queries from')
+    parser.add_argument('--out', help='default Stuff/neighbors.npz, Stuff/rec_neighbors.npz with --rec')
+    args = parser.parse_args()
+    
+    start = time.perf_counter()
+    if args.rec:
+        args.out = args.out or 'Stuff/rec_neighbors.npz'
+        build_rec_neighbors(args.k, args.chunk_size, args.out)
+    else:
+        args.out = args.out or 'Stuff/neighbors.npz'
+        build_full_catalog_neighbors(args.k, args.chunk_size, args.out)
+    print(f"Saved neighbour lists to {args.out} in {time.perf_counter() - start:.1f}s")
@@ -1,156 +1,1236 @@
+import hashlib
+import os
+import threading
+import weakref
+from itertools import islice
+
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from scipy.sparse import hstack
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import hstack, csr_matrix, diags
+from sklearn.preprocessing import normalize
 import joblib
 
-full_data = pd.read_csv('Data/rec_allgames.csv')
-rec_data = pd.read_csv('Data/rec_data.csv')
-scaler = joblib.load('Stuff/scaler.pkl')            # price and days since reference .5 weight
-scaler1 = joblib.load('Stuff/scaler1.pkl')          # wilson score .7 weight
-vectorizer = joblib.load('Stuff/vectorizer.pkl')    # combined info .8 weight
-weighted_features = joblib.load('Stuff/weighted_features.pkl')
+from artifacts import changed_sources, current_artifacts, has_artifacts, load_artifacts, read_manifest
+from neighbors import load_neighbors
+from embedding import load_embedding, project
+from lrucache import LRUCache
+from shardedscoring import ShardedScorer
+from searchindex import NameSearchIndex
+from stats import stats as shared_stats
+
 
+def normalize_name(name):
+    return str(name).lower()
 
-def preprocess_user_input(user_games, full_data = full_data, vectorizer = vectorizer, scaler = scaler, scaler1 = scaler1):
+
+class CatalogIndex:
     '''
-    Takes a list of user-selected games (The AppID of the games) and retrieves their features from the fulldata,
-    preprocesses the data and returns the averaged feature vector representation
+    Hash indexes over a games dataframe so lookups don't have to scan the whole thing.
+    
+    - by_id: AppID -> row position in the dataframe
+    - by_name: lowercased name -> list of AppIDs (more than one when names are duplicated)
     '''
     
-    user_feature_vectors = []
+    def __init__(self, data):
+        self.by_id = {}
+        self.by_name = {}
+        
+        for row, (app_id, name) in enumerate(zip(data['AppID'].values, data['Name'].values)):
+            app_id = int(app_id)
+            self.by_id.setdefault(app_id, row)
+            self.by_name.setdefault(normalize_name(name), []).append(app_id)
     
-    for game in user_games:
-        # Check if game exists in full_data
-        game_data = full_data[full_data['AppID'] == int(game)]
-        if game_data.empty:
-            print(f"Game ID {game} not found in dataset")
-            continue
-            
-        combined_info = game_data['combined_info'].values[0]
-        price = game_data['Price'].values[0]
-        wilson_score = game_data['wilson_score'].values[0]
-        days_since_release = game_data['dayssincereference'].values[0]
+    def row(self, app_id):
+        '''Returns the row position of the AppID or None if it isn't in the data'''
+        try:
+            return self.by_id.get(int(app_id))
+        except (TypeError, ValueError):
+            return None
+    
+    def ids_for_name(self, name):
+        '''Returns the list of AppIDs with this name (empty if there are none)'''
+        return self.by_name.get(normalize_name(name), [])
+
+
+# Weights of the numeric blocks in weighted_features (from MatrixCalc.ipynb). The tfidf block has weight 1:
+# MatrixCalc.ipynb computes a text_weight = .9 weighted_tfidf but hstacks the unweighted tfidf_matrix
+numeric_weight = .2     # price and days since reference
+numeric_weight1 = .7    # wilson score
+
+
+def featurize(data, vectorizer, scaler, scaler1, numeric_weight = 1, numeric_weight1 = 1):
+    '''
+    Builds the feature rows of every game in data in the same column layout as weighted_features:
+    [tfidf of combined_info | scaled price and days since reference | scaled wilson score]
+    
+    The numeric blocks are multiplied by numeric_weight and numeric_weight1, pass the module weights
+    to get rows that match weighted_features, leave them at 1 for the user input rows.
+    
+    output:
+    CSR matrix with one row per game in data
+    '''
+    
+    combined_info_vectors = vectorizer.transform(data['combined_info'].fillna(''))
+    numeric_features_scaled = scaler.transform(data[['Price', 'dayssincereference']].values)
+    numeric_features1_scaled = scaler1.transform(data[['wilson_score']].values)
+    
+    return hstack([combined_info_vectors, numeric_features_scaled * numeric_weight, numeric_features1_scaled * numeric_weight1],
+                  format='csr')
+
+
+def weight_columns(features, numeric_weight = numeric_weight, numeric_weight1 = numeric_weight1):
+    '''
+    Multiplies the numeric blocks of feature rows built by featurize with the block weights,
+    turns full_features rows into rows that match weighted_features without featurizing again
+    '''
+    weights = np.ones(features.shape[1], dtype=features.dtype)
+    weights[-3:-1] = numeric_weight
+    weights[-1] = numeric_weight1
+    return (features @ diags(weights)).tocsr()
+
+
+def compact_matrix(matrix):
+    '''
+    CSR copy of matrix with float32 values and int32 indices (half the memory and memory bandwidth of float64),
+    sorted indices so it is ready for scoring. Matrices that are already compact are returned as they are.
+    '''
+    matrix = csr_matrix(matrix)
+    if matrix.dtype == np.float32 and matrix.indices.dtype == np.int32 and matrix.indptr.dtype == np.int32:
+        return matrix
+    
+    compact = csr_matrix((matrix.data.astype(np.float32), matrix.indices.astype(np.int32),
+                          matrix.indptr.astype(np.int32)), shape=matrix.shape)
+    compact.sort_indices()
+    return compact
+
+
+def matrix_fingerprint(*matrices, chunk_size=1 << 20):
+    '''
+    Hash of the shape, structure and values of CSR matrices, stored next to the files built from them
+    (neighbour lists, embedding) so a file built for other feature rows is never used.
+    The values are hashed as float32 with sorted int64 indices, so a compact copy has the same fingerprint.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for matrix in matrices:
+        matrix = csr_matrix(matrix)
+        if not matrix.has_sorted_indices:
+            matrix = matrix.copy()
+            matrix.sort_indices()
+        digest.update(np.asarray(matrix.shape, dtype=np.int64).tobytes())
+        digest.update(matrix.indptr.astype(np.int64).tobytes())
+        for start in range(0, matrix.nnz, chunk_size):
+            digest.update(matrix.indices[start:start + chunk_size].astype(np.int64).tobytes())
+            digest.update(matrix.data[start:start + chunk_size].astype(np.float32).tobytes())
+    return digest.hexdigest()
+
+
+# Feature blocks of weighted_features in column order, with the weights baked into it
+BLOCKS = ('tfidf', 'numeric', 'wilson')
+default_weights = {'tfidf': 1, 'numeric': numeric_weight, 'wilson': numeric_weight1}
+
+
+def block_weights(weights=None):
+    '''
+    Complete tuple of block weights in BLOCKS order from a dict of some of them (the rest keep their default),
+    None when every weight is the default one
+    '''
+    if not weights:
+        return None
+    unknown = set(weights) - set(BLOCKS)
+    if unknown:
+        raise ValueError(f"Unknown feature blocks {sorted(unknown)}, the blocks are {list(BLOCKS)}")
+    
+    values = tuple(float(weights.get(block, default_weights[block])) for block in BLOCKS)
+    if any(not np.isfinite(value) or value < 0 for value in values) or not any(values):
+        raise ValueError("Block weights must be non negative numbers and not all 0")
+    if values == tuple(float(default_weights[block]) for block in BLOCKS):
+        return None
+    return values
+
+
+class FeatureBlocks:
+    '''
+    The rec_data feature rows split into their blocks, so the block weights can be picked per query:
+    
+    - tfidf: the tfidf columns of weighted_features (weight 1 there), used in place instead of copying them
+    - numeric: unweighted scaled price, days since reference and wilson score, a dense rec_data x 3 array
+    - norms: squared L2 norm of every row's tfidf / numeric / wilson part, rec_data x 3
+    
+    The cosine similarity with catalog rows weighted by (w_tfidf, w_numeric, w_wilson) then is
+    sum(w_b * user_b . row_b) / (|user| * sqrt(sum(w_b^2 * |row_b|^2))), three dot products and no new matrix.
+    With the default weights it is the same score as normalized_features @ user_vector.
+    '''
+    
+    def __init__(self, weighted_features):
+        matrix = csr_matrix(weighted_features)
+        self.n_text = matrix.shape[1] - 3
+        self.matrix = matrix
+        
+        numeric = matrix[:, self.n_text:].toarray().astype(np.float64)
+        numeric[:, :2] /= default_weights['numeric']
+        numeric[:, 2] /= default_weights['wilson']
+        self.numeric = numeric
+        
+        # Squared norm of each row's tfidf part, summed straight from the stored values of its tfidf columns
+        text_squares = np.square(matrix.data, dtype=np.float64)
+        text_squares[matrix.indices >= self.n_text] = 0
+        rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        numeric_squares = numeric ** 2
+        self.norms = np.column_stack([
+            np.bincount(rows, weights=text_squares, minlength=matrix.shape[0]),
+            numeric_squares[:, :2].sum(axis=1),
+            numeric_squares[:, 2],
+        ])
+    
+    def scores(self, user_vector, weights):
+        '''
+        Cosine similarity of a dense normalized user vector (full_features layout) with every row,
+        the catalog blocks weighted by weights (a tuple in BLOCKS order)
+        '''
+        text_weight, numeric_weight, wilson_weight = weights
+        
+        # The tfidf dot products in one mat-vec over the matrix, with the user's numeric columns left out
+        text_vector = user_vector.copy()
+        text_vector[self.n_text:] = 0
+        dot = text_weight * (self.matrix @ text_vector)
+        dot += numeric_weight * (self.numeric[:, :2] @ user_vector[self.n_text:self.n_text + 2])
+        dot += wilson_weight * self.numeric[:, 2] * user_vector[-1]
+        
+        norms = np.sqrt(self.norms @ np.square(weights))
+        # Rows that are all 0 score 0, like normalize leaves them
+        return np.divide(dot, norms, out=np.zeros_like(dot), where=norms > 0)
+
+
+class SortedColumn:
+    '''
+    A numeric column stored sorted along with the row each value came from,
+    so a threshold filter is a searchsorted cutoff instead of a comparison over the whole dataframe.
+    
+    Rows where the value is missing are never filtered out (the same as a pandas comparison with NaN).
+    '''
+    
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        self.values = values
+        self.size = len(values)
+        self.order = np.argsort(values, kind='stable')    # NaNs get sorted to the end
+        self.sorted = values[self.order]
+        self.n_valid = self.size - int(np.isnan(values).sum())
+    
+    def _cut(self, value, side):
+        return np.searchsorted(self.sorted[:self.n_valid], value, side=side)
+    
+    def at_most(self, value):
+        '''Boolean mask of the rows with a value <= value'''
+        mask = np.ones(self.size, dtype=bool)
+        mask[self.order[self._cut(value, 'right'):self.n_valid]] = False
+        return mask
+    
+    def at_least(self, value):
+        '''Boolean mask of the rows with a value >= value'''
+        mask = np.ones(self.size, dtype=bool)
+        mask[self.order[:self._cut(value, 'left')]] = False
+        return mask
+    
+    def between(self, low=None, high=None):
+        '''Boolean mask of the rows with low <= value <= high, either end can be None'''
+        mask = np.ones(self.size, dtype=bool)
+        if low is not None:
+            mask[self.order[:self._cut(low, 'left')]] = False
+        if high is not None:
+            mask[self.order[self._cut(high, 'right'):self.n_valid]] = False
+        return mask
+
+
+class FilterIndex:
+    '''
+    Precomputed column arrays of the games that can be recommended, used to build the filter mask for a request.
+    Every filter is a boolean mask over the rows, they get combined and applied to the scores in one pass.
+    '''
+    
+    def __init__(self, data, columns=('Price', 'wilson_score', 'dayssincereference', 'Achievements')):
+        self.size = len(data)
+        self.catalog_index = CatalogIndex(data)
+        self.columns = {column: SortedColumn(data[column].values) for column in columns if column in data}
         
-        combined_info_vector = vectorizer.transform([combined_info])
+        # AppIDs in sorted order with their rows, to look up many AppIDs at once with searchsorted
+        app_ids = data['AppID'].values.astype(np.int64)
+        self.id_order = np.argsort(app_ids, kind='stable')
+        self.sorted_ids = app_ids[self.id_order]
+    
+    def rows(self, app_ids):
+        '''Row positions of the AppIDs that are in the data'''
+        rows = (self.catalog_index.row(app_id) for app_id in app_ids)
+        return np.fromiter((row for row in rows if row is not None), dtype=np.intp)
+    
+    def rows_of(self, app_ids):
+        '''Row positions of an array of AppIDs that are in the data, looked up all at once (for long lists)'''
+        app_ids = np.asarray(app_ids, dtype=np.int64)
+        positions = np.searchsorted(self.sorted_ids, app_ids)
+        found = positions < len(self.sorted_ids)
+        found[found] = self.sorted_ids[positions[found]] == app_ids[found]
+        return self.id_order[positions[found]]
+    
+    def mask(self, exclude_ids=(), max_price=None, min_wilson_score=None, ranges=None, exclude_mask=None):
+        '''
+        Returns a boolean mask of the rows that pass every filter
+        
+        Parameters:
+        - exclude_ids: AppIDs that can't be recommended (the user's games)
+        - max_price: maximum price filter (optional)
+        - min_wilson_score: minimum wilson score filter (optional)
+        - ranges: optional dict of column -> (low, high) for any other indexed column, None for an open end
+        - exclude_mask: optional boolean mask of more rows that can't be recommended (ExclusionList.mask)
+        '''
+        keep = np.ones(self.size, dtype=bool)
+        keep[self.rows(exclude_ids)] = False
+        if exclude_mask is not None:
+            keep &= ~exclude_mask
         
-        numeric_features = np.array([[price, days_since_release]])
-        numeric_features1 = np.array([[wilson_score]])
+        if max_price is not None:
+            keep &= self.columns['Price'].at_most(max_price)
         
-        numeric_features_scaled = scaler.transform(numeric_features)
-        numeric_features1_scaled = scaler1.transform(numeric_features1)
+        if min_wilson_score is not None:
+            keep &= self.columns['wilson_score'].at_least(min_wilson_score)
         
-        combined_vector = hstack([combined_info_vector, numeric_features_scaled, numeric_features1_scaled])
+        for column, (low, high) in (ranges or {}).items():
+            keep &= self.columns[column].between(low, high)
         
-        user_feature_vectors.append(combined_vector.toarray())
+        return keep
     
-    if not user_feature_vectors:
-        raise ValueError("No valid games found to process")
+    def passes(self, rows, exclude_ids=(), max_price=None, min_wilson_score=None):
+        '''
+        Same filters as mask for just the given rows (a few candidates instead of the whole data)
         
-    user_feature_vectors_avg = np.mean(user_feature_vectors, axis = 0)
+        output:
+        boolean array, True for the rows that pass
+        '''
+        keep = ~np.isin(rows, self.rows(exclude_ids))
+        if max_price is not None:
+            keep &= ~(self.columns['Price'].values[rows] > max_price)
+        if min_wilson_score is not None:
+            keep &= ~(self.columns['wilson_score'].values[rows] < min_wilson_score)
+        return keep
+
+
+def selection_key(user_games):
+    '''
+    Cache key of a game selection: the sorted AppIDs (the average doesn't depend on the order).
+    None when an entry isn't an AppID, those selections aren't cached.
+    '''
+    try:
+        return tuple(sorted(int(game) for game in user_games))
+    except (TypeError, ValueError):
+        return None
+
+
+def result_cache_key(key, n, max_price=None, min_wilson_score=None, exclusions_key=None, weights=None, mode='exact',
+                     batched=False):
+    '''
+    Key of a result in the result cache (None when the selection isn't cached, key is its selection_key).
     
-    return user_feature_vectors_avg
+    Results of get_recommendations_many (batched) are kept apart from the single query ones: their scores come out
+    of a matrix-matrix product and can differ in the last bit, enough to swap near ties at the n-th place, so
+    whichever path filled the cache first would decide what the other one returns.
+    '''
+    if key is None:
+        return None
+    return (key, n, max_price, min_wilson_score, exclusions_key, weights, mode, batched)
 
 
-def get_recommendations(user_games, n=5, data=rec_data, weighted_features=weighted_features, max_price=None, min_wilson_score=None):
+def top_n_indices(scores, candidates, n):
+    '''
+    Returns the candidate rows with the n highest scores, best first.
+    Uses a partial selection (argpartition) so only the n winners get fully sorted.
     '''
-    Takes the averaged feature vector representation of the user-selected games and returns the top n recommendations
-    from the rec_data dataset.
     
-    Parameters:
-    - user_games: list of game IDs
-    - n: number of recommendations to return (default=5)
-    - data: dataset to pull recommendations from
-    - weighted_features: pre-computed feature matrix
-    - max_price: maximum price filter (optional)
-    - min_wilson_score: minimum wilson score filter (optional)
-    '''
-    # Get the average feature vector from full_data games
-    try:
-        user_feature_vectors_avg = preprocess_user_input(user_games)
-    except Exception as e:
-        print(f"Error preprocessing user games: {e}")
-        return [], []
+    if n <= 0:
+        return candidates[:0]
+    
+    if len(candidates) > n:
+        top = np.argpartition(scores[candidates], -n)[-n:]
+        candidates = candidates[top]
+    
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order]
 
-    # Calculate similarity with games in rec_data
-    similarity_scores = cosine_similarity(user_feature_vectors_avg.reshape(1, -1), weighted_features)
-    similarity_scores_flat = similarity_scores.flatten()
+
+class RecommendationCursor:
+    '''
+    Lazy ranked walk over the candidate rows of one query, best first, that can be resumed at any time.
     
-    # Get indices of user's games in rec_data (if they exist)
-    user_game_indices = data[data['AppID'].isin(user_games)].index
+    Rows get ranked in chunks out of the ones not ranked yet: a partial selection (top_n_indices) of the next chunk,
+    whose size doubles, so browsing deep costs a few passes over the candidates and a page that was already
+    ranked costs nothing. rewind() starts again from the top without ranking anything again.
     
-    # Set similarity scores of user's games to -1 to exclude them
-    similarity_scores_flat[user_game_indices] = -1
+    Parameters:
+    - scores: scores of every row (read only, shared with the score cache)
+    - candidates: rows that passed the filters
+    - page_size: default number of rows next_page returns
+    - ranked: rows already shown, best first (e.g. the top n of get_recommendations), the cursor resumes after them
+    '''
+    
+    def __init__(self, scores, candidates, page_size=10, ranked=None):
+        self.scores = scores
+        self.page_size = page_size
+        self._ranked = candidates[:0]
+        self._remaining = candidates
+        if ranked is not None and len(ranked):
+            self._ranked = np.asarray(ranked, dtype=candidates.dtype)
+            self._remaining = candidates[~np.isin(candidates, self._ranked)]
+        self.total = len(self._ranked) + len(self._remaining)
+        self.position = len(self._ranked)
+    
+    def __len__(self):
+        return self.total
+    
+    @property
+    def has_more(self):
+        return self.position < self.total
     
-    # Apply price filter if specified
-    if max_price is not None:
-        price_filter_indices = data[data['Price'] > max_price].index
-        similarity_scores_flat[price_filter_indices] = -1
+    def _rank(self, needed):
+        '''Ranks the next chunk of the remaining rows, at least needed of them'''
+        size = max(needed, len(self._ranked), self.page_size)
+        chunk = top_n_indices(self.scores, self._remaining, size)
+        
+        taken = np.zeros(len(self.scores), dtype=bool)
+        taken[chunk] = True
+        self._remaining = self._remaining[~taken[self._remaining]]
+        self._ranked = np.concatenate([self._ranked, chunk])
+    
+    def next_page(self, size=None):
+        '''
+        The next size (default page_size) rows and their scores, empty lists once every candidate was returned
+        '''
+        size = self.page_size if size is None else size
+        end = self.position + size
+        if end > len(self._ranked) and len(self._remaining):
+            self._rank(end - len(self._ranked))
+        
+        rows = self._ranked[self.position:end]
+        self.position += len(rows)
+        return rows.tolist(), self.scores[rows]
     
-    # Apply wilson score filter if specified
-    if min_wilson_score is not None:
-        wilson_filter_indices = data[data['wilson_score'] < min_wilson_score].index
-        similarity_scores_flat[wilson_filter_indices] = -1
+    def rewind(self):
+        self.position = 0
     
-    # Get top n recommendations
-    top_indices = similarity_scores_flat.argsort()[::-1]  # Sort all indices by similarity score
-    top_indices = [i for i in top_indices if similarity_scores_flat[i] != -1][:n]  # Exclude filtered games and pick top n
+    def __iter__(self):
+        '''(row, score) pairs from the current position on, ranked a page at a time as they are consumed'''
+        while True:
+            rows, scores = self.next_page()
+            if not rows:
+                return
+            yield from zip(rows, scores)
 
-    if not top_indices:
-        raise ValueError("No recommendations found matching the specified criteria")
 
-    return top_indices, similarity_scores_flat[top_indices]
+def built_for(arrays, state):
+    '''Whether a file built offline (arrays as loaded from its npz) carries the fingerprint of state'''
+    return 'fingerprint' in arrays and str(arrays['fingerprint']) == state.fingerprint
 
 
-def check_game(game):
+class EngineState:
     '''
-    game is a string that is the name of a game
+    Everything a RecommenderEngine loaded from one artifact set (or the CSVs and pickles):
+    the catalogs, the model, the feature matrices and the indexes built over them.
     
-    output:
-    Outputs True or False if the game is in the dataset
+    A reload builds a new EngineState and swaps it in, so a query always sees one consistent set.
+    
+    With compact=True the feature matrices are kept as float32 values with int32 indices (see compact_matrix)
+    and the user vectors are built in float32 as well. Artifacts exported with --compact are already stored that way.
     '''
     
-    try:
-        app_id = int(game)
-        if not full_data[full_data['AppID'] == app_id].empty:
-            return True
-    except ValueError:
-        pass
+    def __init__(self, full_data, rec_data, scaler, scaler1, vectorizer, weighted_features, full_features=None,
+                 normalized_features=None, compact=False):
+        self.full_data = full_data
+        self.rec_data = rec_data
+        self.scaler = scaler
+        self.scaler1 = scaler1
+        self.vectorizer = vectorizer
+        self.weighted_features = weighted_features
+        
+        # Feature rows of every game in full_data, built once so user input doesn't need to be featurized per request
+        if full_features is None:
+            full_features = featurize(full_data, vectorizer, scaler, scaler1)
+        self.full_features = full_features
+        
+        # weighted_features with every row L2 normalized once, so scoring a request doesn't re-normalize the catalog
+        if normalized_features is None:
+            normalized_features = normalize(csr_matrix(weighted_features))
+        self.normalized_features = normalized_features
+        
+        if compact:
+            self.weighted_features = compact_matrix(self.weighted_features)
+            self.full_features = compact_matrix(self.full_features)
+            self.normalized_features = compact_matrix(self.normalized_features)
+        
+        # Precision the user vectors are built in, the same as the matrix they get scored against
+        self.dtype = self.normalized_features.dtype
+        
+        self.catalog_index = CatalogIndex(full_data)
+        self.rec_filters = FilterIndex(rec_data)
+        
+        # Filled in by RecommenderEngine.load_full_catalog on first use
+        self.neighbor_lists = None
+        self.full_catalog_features = None
+        self.full_catalog_filters = None
+        
+        # Filled in by RecommenderEngine.load_svd_embedding on the first 'svd' query
+        self.embedding = None
+        
+        # Filled in by RecommenderEngine.load_rec_neighbors on the first 1 or 2 game query, {} when there is no table
+        self.rec_neighbor_table = None
+        
+        # Memoized scores and results of recent selections, set by the RecommenderEngine that loaded this state
+        # (a reload brings new empty caches, so nothing computed on the old data is ever served)
+        self.score_cache = LRUCache(0)
+        self.result_cache = LRUCache(0)
+        
+        # ShardedScorer over the same artifacts when the engine runs with workers
+        self.scorer = None
+        
+        self._search_index = None
+        self._feature_blocks = None
+        self._fingerprint = None
+    
+    @property
+    def search_index(self):
+        '''Name search index over full_data, built on first use (only the Application needs it)'''
+        if self._search_index is None:
+            self._search_index = NameSearchIndex.from_data(self.full_data)
+        return self._search_index
+    
+    @property
+    def feature_blocks(self):
+        '''FeatureBlocks of weighted_features, built on the first query with its own block weights'''
+        if self._feature_blocks is None:
+            self._feature_blocks = FeatureBlocks(self.weighted_features)
+        return self._feature_blocks
     
+    @property
+    def fingerprint(self):
+        '''matrix_fingerprint of full_features and normalized_features, the files built offline have to match it'''
+        if self._fingerprint is None:
+            self._fingerprint = matrix_fingerprint(self.full_features, self.normalized_features)
+        return self._fingerprint
     
-    game = game.lower()
-    matching_games = full_data[full_data['Name'].str.lower() == game]
+    @classmethod
+    def from_artifacts(cls, path, compact=False):
+        artifacts = load_artifacts(path, compact=compact)
+        return cls(artifacts['full_data'], artifacts['rec_data'], artifacts['scaler'], artifacts['scaler1'],
+                   artifacts['vectorizer'], artifacts['weighted_features'], artifacts['full_features'],
+                   artifacts['normalized_features'], compact=compact)
     
-    if matching_games.empty:
-        print('Game not found in the dataset.')
-        return False  # Game name not found
-    elif matching_games.shape[0] > 1:
-        print('Multiple games with this name found. Please use the AppID to specify.')
-        return False  # Multiple games with the same name
-    else:
-        return True  # Unique game name found
+    @classmethod
+    def from_files(cls, data_dir='Data', model_dir='Stuff', compact=False):
+        return cls(pd.read_csv(os.path.join(data_dir, 'rec_allgames.csv')),
+                   pd.read_csv(os.path.join(data_dir, 'rec_data.csv')),
+                   joblib.load(os.path.join(model_dir, 'scaler.pkl')),            # price and days since reference, numeric_weight
+                   joblib.load(os.path.join(model_dir, 'scaler1.pkl')),           # wilson score, numeric_weight1
+                   joblib.load(os.path.join(model_dir, 'vectorizer.pkl')),        # combined info, weight 1 (see BLOCKS)
+                   joblib.load(os.path.join(model_dir, 'weighted_features.pkl')),
+                   compact=compact)
 
 
-def get_game_id(game):
+class RecommenderEngine:
     '''
-    input: game name or id
+    Loads the recommender data and model and answers queries against them.
     
-    output:
-    Outputs the id of the games
+    Nothing is read until the first query or an explicit warm(). The memory mapped artifacts in artifact_dir
+    (python artifacts.py export) are used when they exist, otherwise the CSVs in data_dir and the pickles in model_dir.
+    reload() loads a new artifact set and swaps it in without restarting the process.
+    
+    Stage timings and counters go to stats (the shared stats.stats by default), they are only recorded when it is enabled.
+    
+    Recent selections are memoized: the averaged user vector and score array per set of AppIDs (score_cache_size
+    entries) and the final results per set of AppIDs, n and filters (result_cache_size entries), optionally expiring
+    after cache_ttl seconds. Changing only n or the filters reuses the scores instead of scoring the catalog again.
+    
+    compact=True scores in float32 (see EngineState), the rankings match the float64 path up to near ties.
+    
+    workers=N scores get_recommendations on N processes (see shardedscoring.py), only when loading from artifact_dir.
+    The score cache isn't used then, the shards never send back full score arrays.
+    
+    get_recommendations(mode='svd') scores in the dense embedding at embedding_path (built offline by embedding.py).
+    
+    Queries of 1 or 2 games are answered from the rec_data neighbour table at rec_neighbors_path when there is one
+    (python neighbors.py --rec), with the same results as scoring the catalog. They fall back to scoring the catalog
+    when the filters leave too few of the neighbours to be sure of the top n.
     '''
     
-    # if its an id or game name, return the id
+    def __init__(self, artifact_dir='Artifacts', data_dir='Data', model_dir='Stuff', neighbors_path='Stuff/neighbors.npz',
+                 stats=None, score_cache_size=32, result_cache_size=256, cache_ttl=None, compact=False,
+                 workers=0, embedding_path='Stuff/embedding.npz', rec_neighbors_path='Stuff/rec_neighbors.npz'):
+        self.artifact_dir = artifact_dir
+        self.data_dir = data_dir
+        self.model_dir = model_dir
+        self.neighbors_path = neighbors_path
+        self.rec_neighbors_path = rec_neighbors_path
+        self.embedding_path = embedding_path
+        self.stats = stats or shared_stats
+        self.score_cache_size = score_cache_size
+        self.result_cache_size = result_cache_size
+        self.cache_ttl = cache_ttl
+        self.compact = compact
+        self.workers = workers
+        self.generation = 0     # bumped every time a new state is swapped in
+        self._state = None
+        self._lock = threading.Lock()
     
-    try:
-        app_id = int(game)
-        if not full_data[full_data['AppID'] == app_id].empty:
-            return app_id
-    except ValueError:
-        game = game.lower()
-        matching_game = full_data[full_data['Name'].str.lower() == game]
-        return matching_game['AppID'].values[0]
+    def _load_state(self):
+        path = None
+        if self.artifact_dir and has_artifacts(self.artifact_dir):
+            # The version CURRENT points to now, the state and the workers both load that one
+            path = current_artifacts(self.artifact_dir)
+            changed = changed_sources(read_manifest(path), self.data_dir, self.model_dir)
+            if changed:
+                print(f"{', '.join(changed)} changed since {path} was exported, loading them instead "
+                      "(python artifacts.py export to update the artifacts)")
+                path = None
+        if path is not None:
+            state = EngineState.from_artifacts(path, self.compact)
+            if self.workers:
+                state.scorer = ShardedScorer(path, read_manifest(path), self.workers, self.compact)
+                # The pool stops once the state is swapped out and the queries still running on it are done
+                weakref.finalize(state, state.scorer.close)
+        else:
+            state = EngineState.from_files(self.data_dir, self.model_dir, self.compact)
+        state.score_cache = LRUCache(self.score_cache_size, self.cache_ttl)
+        state.result_cache = LRUCache(self.result_cache_size, self.cache_ttl)
+        return state
+    
+    def clear_cache(self):
+        '''Drops the memoized scores and results of the current state'''
+        state = self._state
+        if state is not None:
+            state.score_cache.clear()
+            state.result_cache.clear()
+    
+    @property
+    def state(self):
+        '''The loaded EngineState, loads it on first access'''
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    with self.stats.timer('engine.load'):
+                        self._state = self._load_state()
+                    self.generation += 1
+                state = self._state
+        return state
+    
+    @property
+    def loaded(self):
+        return self._state is not None
+    
+    def warm(self):
+        '''Loads everything now instead of on the first query'''
+        self.state
+        return self
+    
+    def reload(self, artifact_dir=None):
+        '''
+        Loads a new artifact set (artifact_dir or the current one) and swaps it in.
+        Queries that already started finish on the old state, the old state is freed once they are done.
+        '''
+        if artifact_dir is not None:
+            self.artifact_dir = artifact_dir
+        
+        with self.stats.timer('engine.reload'):
+            state = self._load_state()
+        with self._lock:
+            self._state = state
+            self.generation += 1
+        return self
+    
+    # Shortcuts to the current state
+    full_data = property(lambda self: self.state.full_data)
+    rec_data = property(lambda self: self.state.rec_data)
+    search_index = property(lambda self: self.state.search_index)
+    
+    def preprocess_user_input(self, user_games, state=None):
+        '''
+        Takes a list of user-selected games (The AppID of the games) and retrieves their feature rows from full_features,
+        returns the averaged feature vector representation as a 1 x n_features sparse row
+        '''
+        state = state or self.state
+        
+        with self.stats.timer('preprocess_user_input'):
+            rows = []
+            
+            for game in user_games:
+                # Check if game exists in full_data
+                row = state.catalog_index.row(game)
+                if row is None:
+                    print(f"Game ID {game} not found in dataset")
+                    continue
+                rows.append(row)
+            
+            if not rows:
+                raise ValueError("No valid games found to process")
+            
+            # Sum the selected rows with a sparse product and divide, same as np.mean over the dense rows
+            selector = csr_matrix(np.ones((1, len(rows)), dtype=state.dtype))
+            user_feature_vectors_avg = (selector @ state.full_features[rows]) / len(rows)
+        
+        return user_feature_vectors_avg
+    
+    def get_recommendations(self, user_games, n=5, max_price=None, min_wilson_score=None, exclusions=None,
+                            weights=None, mode='exact'):
+        '''
+        Takes the averaged feature vector representation of the user-selected games and returns the top n recommendations
+        from the rec_data dataset.
+        
+        Parameters:
+        - user_games: list of game IDs
+        - n: number of recommendations to return (default=5)
+        - max_price: maximum price filter (optional)
+        - min_wilson_score: minimum wilson score filter (optional)
+        - exclusions: ExclusionList of games the user owns or blocked, never recommended (optional)
+        - weights: dict of block -> weight for some of the blocks 'tfidf', 'numeric' (price and days since reference)
+          and 'wilson' to score with instead of the ones in weighted_features (optional, see FeatureBlocks)
+        - mode: 'exact' cosine similarity with the feature rows, or 'svd' for the approximate scores of the dense
+          embedding built by embedding.py (faster, see its recall@n report)
+        '''
+        stats = self.stats
+        with stats.timer('get_recommendations'):
+            state = self.state
+            key = selection_key(user_games)
+            exclusions_key = None if not exclusions else exclusions.key
+            weights = self._scoring(state, weights, mode)
+            
+            # Same selection, n, filters, scoring and version of the exclusion list as a recent request
+            result_key = result_cache_key(key, n, max_price, min_wilson_score, exclusions_key, weights, mode)
+            if result_key is not None:
+                cached = state.result_cache.get(result_key)
+                stats.count('cache.result_miss' if cached is None else 'cache.result_hit')
+                if cached is not None:
+                    top_indices, scores = cached
+                    return list(top_indices), scores.copy()
+            
+            found = None
+            if key is not None and len(set(key)) == len(key) <= 2 and weights is None and mode == 'exact':
+                with stats.timer('get_recommendations.neighbor_table'):
+                    found = self._from_neighbor_table(state, user_games, n, max_price, min_wilson_score, exclusions)
+                if state.rec_neighbor_table:
+                    stats.count('neighbor_table.miss' if found is None else 'neighbor_table.hit')
+            
+            if found is not None:
+                top_indices, top_scores = found
+            # The shards only hold normalized_features, other block weights and the svd mode get scored here
+            elif state.scorer is not None and weights is None and mode == 'exact':
+                try:
+                    user_feature_vectors_avg = self.preprocess_user_input(user_games, state)
+                except Exception as e:
+                    print(f"Error preprocessing user games: {e}")
+                    return [], []
+                
+                # Every shard gets scored and filtered in its own process, only the shard winners come back
+                with stats.timer('get_recommendations.sharded'):
+                    user_vector = normalize(user_feature_vectors_avg).toarray().ravel()
+                    exclude_rows = state.rec_filters.rows(user_games)
+                    if exclusions:
+                        exclude_rows = np.concatenate([exclude_rows, np.flatnonzero(exclusions.mask(state.rec_filters))])
+                    rows, top_scores, n_candidates = state.scorer.top_n(
+                        user_vector, exclude_rows, n, max_price, min_wilson_score)
+                stats.observe('get_recommendations.candidates', n_candidates)
+                top_indices = rows.tolist()
+            else:
+                try:
+                    similarity_scores_flat = self._user_scores(state, user_games, key, weights, mode)[1]
+                except Exception as e:
+                    print(f"Error preprocessing user games: {e}")
+                    return [], []
+                
+                # Rows that can be recommended: not one of the user's games, not owned or blocked and passing the
+                # price and wilson score filters
+                with stats.timer('get_recommendations.filter'):
+                    exclude_mask = exclusions.mask(state.rec_filters) if exclusions else None
+                    keep = state.rec_filters.mask(exclude_ids=user_games, max_price=max_price, min_wilson_score=min_wilson_score,
+                                                  exclude_mask=exclude_mask)
+                    candidates = np.flatnonzero(keep)
+                stats.observe('get_recommendations.candidates', len(candidates))
+                
+                # Get top n recommendations out of the games that are left
+                with stats.timer('get_recommendations.top_n'):
+                    top_indices = top_n_indices(similarity_scores_flat, candidates, n).tolist()
+                top_scores = similarity_scores_flat[top_indices]
+            
+            if not top_indices:
+                raise ValueError("No recommendations found matching the specified criteria")
+            
+            if result_key is not None:
+                state.result_cache.put(result_key, (top_indices, top_scores))
+            return list(top_indices), top_scores.copy()
+    
+    def _scoring(self, state, weights, mode):
+        '''Checks the block weights and scoring mode of a query, returns the weights as a block_weights tuple'''
+        weights = block_weights(weights)
+        if mode not in ('exact', 'svd'):
+            raise ValueError(f"Unknown scoring mode {mode!r}, use 'exact' or 'svd'")
+        if mode == 'svd' and weights is not None:
+            raise ValueError("Block weights are only supported by the exact scoring mode")
+        if mode == 'svd' and state.embedding is None:
+            self.load_svd_embedding(state=state)
+        return weights
+    
+    def recommendation_cursor(self, user_games, page_size=10, max_price=None, min_wilson_score=None, exclusions=None,
+                              weights=None, mode='exact', ranked=None):
+        '''
+        Ranked recommendations of the user's games a page at a time, for "show more" browsing.
+        Same parameters as get_recommendations, the catalog is scored once (or the scores come from the score cache)
+        and every further page only ranks as many games as it needs.
+        ranked are the rows already shown (the result of get_recommendations for the first page), the cursor starts
+        after them.
+        
+        output:
+        RecommendationCursor, empty when nothing passes the filters
+        '''
+        with self.stats.timer('recommendation_cursor'):
+            state = self.state
+            weights = self._scoring(state, weights, mode)
+            scores = self._user_scores(state, user_games, selection_key(user_games), weights, mode)[1]
+            
+            exclude_mask = exclusions.mask(state.rec_filters) if exclusions else None
+            keep = state.rec_filters.mask(exclude_ids=user_games, max_price=max_price, min_wilson_score=min_wilson_score,
+                                          exclude_mask=exclude_mask)
+            return RecommendationCursor(scores, np.flatnonzero(keep), page_size, ranked)
+    
+    def _user_scores(self, state, user_games, key=None, weights=None, mode='exact'):
+        '''
+        Averaged feature vector of the user's games and its cosine similarity with every rec_data game,
+        from the score cache when the same set of games was scored recently (key is their selection_key).
+        weights is a tuple from block_weights, None for the weights of weighted_features.
+        mode 'svd' scores in the dense embedding instead.
+        '''
+        if key is not None and (weights is not None or mode != 'exact'):
+            key = (key, weights, mode)
+        scored = None if key is None else state.score_cache.get(key)
+        self.stats.count('cache.score_miss' if scored is None else 'cache.score_hit')
+        if scored is not None:
+            return scored
+        
+        # Get the average feature vector from full_data games
+        user_feature_vectors_avg = self.preprocess_user_input(user_games, state)
+        
+        # Cosine similarity with games in rec_data - the rows are already normalized so it's one mat-vec
+        with self.stats.timer('get_recommendations.score'):
+            if mode == 'svd':
+                # One dense float32 mat-vec over the rec_data x dims embedding
+                similarity_scores_flat = state.embedding['embedding'] @ project(
+                    state.embedding['components'], normalize(user_feature_vectors_avg))
+            else:
+                user_vector = normalize(user_feature_vectors_avg).toarray().ravel().astype(state.dtype, copy=False)
+                if weights is None:
+                    similarity_scores_flat = state.normalized_features @ user_vector
+                else:
+                    similarity_scores_flat = state.feature_blocks.scores(user_vector, weights)
+        
+        # Shared between requests, nobody gets to modify it
+        similarity_scores_flat.flags.writeable = False
+        scored = (user_feature_vectors_avg, similarity_scores_flat)
+        if key is not None:
+            state.score_cache.put(key, scored)
+        return scored
+    
+    def get_recommendations_many(self, requests, state=None, cache=True):
+        '''
+        Answers several get_recommendations requests with one pass over the catalog: the selected rows of every request
+        are averaged with one sparse selector product into a users x features matrix, which gets scored with one
+        sparse matrix - dense matrix product instead of one mat-vec each.
+        
+        Parameters:
+        - requests: list of (user_games, n, max_price, min_wilson_score)
+        - cache: read and fill the result cache (turn it off for bulk jobs so they don't push out interactive results)
+        
+        output:
+        list with the (indices, scores) of every request, the same as get_recommendations would return,
+        or the exception when none of its games are in the data or nothing passed the filters
+        (AppIDs that aren't in the data are skipped)
+        '''
+        state = state or self.state
+        stats = self.stats
+        results = [None] * len(requests)
+        pending, result_keys, selected_rows, counts = [], [], [], []
+        
+        for i, (user_games, n, max_price, min_wilson_score) in enumerate(requests):
+            key = selection_key(user_games) if cache else None
+            result_key = result_cache_key(key, n, max_price, min_wilson_score, batched=True)
+            cached = None if result_key is None else state.result_cache.get(result_key)
+            if cached is not None:
+                stats.count('cache.result_hit')
+                results[i] = (list(cached[0]), cached[1].copy())
+                continue
+            
+            rows = [row for row in map(state.catalog_index.row, user_games) if row is not None]
+            if not rows:
+                results[i] = ValueError("No valid games found to process")
+                continue
+            pending.append(i)
+            result_keys.append(result_key)
+            selected_rows.extend(rows)
+            counts.append(len(rows))
+        
+        if not pending:
+            return results
+        
+        # One column of scores per request (rec_data games x users), a single pass over the matrix
+        with stats.timer('get_recommendations_many.score'):
+            counts = np.array(counts)
+            indptr = np.concatenate([[0], np.cumsum(counts)])
+            selector = csr_matrix((np.ones(len(selected_rows), dtype=state.dtype), selected_rows, indptr),
+                                  shape=(len(pending), state.full_features.shape[0]))
+            # Sum of the selected rows divided by their count, the same average as preprocess_user_input
+            user_matrix = diags(1 / counts) @ (selector @ state.full_features)
+            user_vectors = normalize(user_matrix).toarray().astype(state.dtype, copy=False)
+            scores = state.normalized_features @ user_vectors.T
+        stats.observe('get_recommendations_many.batch_size', len(pending))
+        
+        with stats.timer('get_recommendations_many.top_n'):
+            # Users x rec_data games copy where the rows that can't be recommended get -inf: one filter mask per
+            # distinct set of filters in the batch, plus every user's own games
+            masked = np.ascontiguousarray(scores.T)
+            users_by_filter = {}
+            for user, i in enumerate(pending):
+                user_games, n, max_price, min_wilson_score = requests[i]
+                users_by_filter.setdefault((max_price, min_wilson_score), []).append(user)
+                masked[user, state.rec_filters.rows(user_games)] = -np.inf
+            for (max_price, min_wilson_score), users in users_by_filter.items():
+                if max_price is None and min_wilson_score is None:
+                    continue
+                removed = np.flatnonzero(~state.rec_filters.mask(max_price=max_price, min_wilson_score=min_wilson_score))
+                masked[np.ix_(users, removed)] = -np.inf
+            
+            # Top n of every user at once, with the largest n of the batch
+            n_rows = masked.shape[1]
+            k = min(max(requests[i][1] for i in pending), n_rows)
+            if k > 0:
+                top = np.argpartition(masked, n_rows - k, axis=1)[:, n_rows - k:]
+                top_scores = np.take_along_axis(masked, top, axis=1)
+                order = np.argsort(-top_scores, axis=1, kind='stable')
+                top = np.take_along_axis(top, order, axis=1)
+                top_scores = np.take_along_axis(top_scores, order, axis=1)
+            
+            for user, (i, result_key) in enumerate(zip(pending, result_keys)):
+                n = requests[i][1]
+                if k <= 0 or n <= 0:
+                    results[i] = ValueError("No recommendations found matching the specified criteria")
+                    continue
+                
+                top_indices = top[user, :n][top_scores[user, :n] > -np.inf].tolist()
+                if not top_indices:
+                    results[i] = ValueError("No recommendations found matching the specified criteria")
+                    continue
+                
+                user_scores = masked[user, top_indices]
+                if result_key is not None:
+                    state.result_cache.put(result_key, (top_indices, user_scores))
+                results[i] = (list(top_indices), user_scores.copy())
+        
+        return results
+    
+    def get_recommendations_batch(self, selections, n=5, max_price=None, min_wilson_score=None, chunk_size=64):
+        '''
+        Recommendations for many users, streamed as a generator in the order of selections.
+        
+        The selections are read chunk_size at a time and every chunk is answered with get_recommendations_many,
+        so memory stays at about chunk_size x rec_data games scores however many users there are.
+        
+        Parameters:
+        - selections: iterable of game ID lists, or of dicts with 'games' and optionally their own
+          'n', 'max_price' and 'min_wilson_score'
+        - n, max_price, min_wilson_score: used for the selections that don't set their own
+        - chunk_size: users scored together
+        
+        output:
+        yields (indices, scores) per selection, ([], []) when none of its games are in the data or nothing passed
+        the filters
+        '''
+        state = self.state
+        selections = iter(selections)
+        
+        while True:
+            chunk = list(islice(selections, chunk_size))
+            if not chunk:
+                return
+            
+            requests = []
+            for selection in chunk:
+                if isinstance(selection, dict):
+                    requests.append((selection['games'], selection.get('n', n), selection.get('max_price', max_price),
+                                     selection.get('min_wilson_score', min_wilson_score)))
+                else:
+                    requests.append((selection, n, max_price, min_wilson_score))
+            
+            for result in self.get_recommendations_many(requests, state, cache=False):
+                yield ([], []) if isinstance(result, Exception) else result
+    
+    def load_full_catalog(self, path=None, state=None):
+        '''
+        Loads what get_recommendations_full_catalog needs: the neighbour lists (built offline by neighbors.py),
+        the normalized weighted feature rows of every full_data game and the filter columns of full_data
+        '''
+        state = state or self.state
+        path = path or self.neighbors_path
+        
+        lists = load_neighbors(path)
+        if not np.array_equal(lists['app_ids'], state.full_data['AppID'].values):
+            raise ValueError(f"{path} was built for a different rec_allgames.csv, rebuild it with neighbors.py")
+        if not built_for(lists, state):
+            raise ValueError(f"{path} was built from other feature rows (e.g. before a catalog update), "
+                             "rebuild it with neighbors.py")
+        
+        state.full_catalog_features = normalize(weight_columns(state.full_features))
+        state.full_catalog_filters = FilterIndex(state.full_data)
+        state.neighbor_lists = lists
+    
+    def _from_neighbor_table(self, state, user_games, n, max_price, min_wilson_score, exclusions):
+        '''
+        Top n of a 1 or 2 game query out of the neighbour lists of those games, None when it can't be sure of them.
+        
+        For 2 games a and b the score of a game r is (|a| s_a(r) + |b| s_b(r)) / |a + b| with s_a, s_b their 1 game
+        scores, so no game outside both lists can score more than the same sum with the last score of each list
+        (for 1 game: more than the last score of its list). The games in the lists get scored exactly, with the same
+        user vector as scoring the catalog, and their top n is the answer when the n-th score beats that bound.
+        '''
+        table = state.rec_neighbor_table
+        if table is None:
+            table = self.load_rec_neighbors(state=state)
+        if not table:
+            return None
+        
+        rows = [state.rec_filters.catalog_index.row(game) for game in user_games]
+        if None in rows:
+            return None
+        lists, list_scores = table['neighbors'][rows], table['scores'][rows]
+        # Every other game is in the lists, there is nothing outside them to beat
+        complete = lists.shape[1] >= state.rec_filters.size - 1
+        
+        found = self._table_user_vector(state, user_games)
+        if found is None:
+            return None
+        user_vector, norms, total_norm = found
+        
+        candidates = np.unique(lists)
+        scores = state.normalized_features[candidates] @ user_vector
+        # A little slack for the float32 list scores
+        bound = (norms @ list_scores[:, -1].astype(np.float64)) / total_norm + 1e-6
+        
+        keep = state.rec_filters.passes(candidates, user_games, max_price, min_wilson_score)
+        if exclusions:
+            keep &= ~exclusions.excluded(state.rec_filters, candidates)
+        top = top_n_indices(scores, np.flatnonzero(keep), n)
+        
+        if not complete and (len(top) < n or scores[top[-1]] <= bound):
+            return None
+        if not len(top):
+            return None
+        return candidates[top].tolist(), scores[top]
+    
+    def _table_user_vector(self, state, user_games):
+        '''
+        normalize(preprocess_user_input(user_games)) of 1 or 2 games as a dense row in state.dtype, straight from the
+        CSR arrays (cheaper than the sparse product and normalize for two short rows) but with the same arithmetic,
+        so the scores are the same to the bit: the rows summed in user_games order and scaled by 1 / len in float64,
+        the norm summed in the order the sparse product leaves the columns in (last seen first).
+        
+        output:
+        (user_vector, the norms of the game rows, the norm of their sum), None when a game is missing or the sum is 0
+        '''
+        # Depends on library internals (checked in FunctionTest.ipynb): scipy's csr @ csr emits a row's columns in
+        # reverse order of first appearance, and sklearn's inplace_csr_row_normalize_l2 sums the squares in stored order
+        features = state.full_features
+        dtype = np.result_type(state.dtype, features.dtype)
+        user_vector = np.zeros(features.shape[1], dtype=dtype)
+        order = []
+        norms = np.zeros(len(user_games))
+        for i, game in enumerate(user_games):
+            row = state.catalog_index.row(game)
+            if row is None:
+                return None
+            start, stop = features.indptr[row], features.indptr[row + 1]
+            columns, data = features.indices[start:stop], features.data[start:stop].astype(dtype, copy=False)
+            order.append(columns if i == 0 else columns[user_vector[columns] == 0])
+            user_vector[columns] += data
+            data = data.astype(np.float64)
+            norms[i] = np.sqrt(data @ data)
+        # Dividing the sparse sum by len makes it float64, so does the rest
+        user_vector = user_vector.astype(np.float64) * (1 / len(user_games))
+        
+        # sklearn's normalize: running sum of the squares, each value divided by the root
+        values = user_vector[np.concatenate(order)[::-1]]
+        norm = np.sqrt(np.cumsum(values * values)[-1]) if len(values) else 0.0
+        if norm == 0:
+            return None
+        user_vector = (user_vector / norm).astype(state.dtype, copy=False)
+        return user_vector, norms, norm * len(user_games)
+    
+    def load_rec_neighbors(self, path=None, state=None):
+        '''
+        Loads the rec_data neighbour table 1 and 2 game queries are answered from (built offline by neighbors.py --rec).
+        Without one, or with one built for other data, every query scores the catalog.
+        '''
+        state = state or self.state
+        path = path or self.rec_neighbors_path
+        
+        table = {}
+        if path and os.path.exists(path):
+            lists = load_neighbors(path)
+            if not np.array_equal(lists['app_ids'], state.rec_data['AppID'].values):
+                print(f"{path} was built for a different rec_data.csv, rebuild it with neighbors.py --rec")
+            elif not built_for(lists, state):
+                print(f"{path} was built from other feature rows (e.g. before a catalog update), "
+                      "rebuild it with neighbors.py --rec")
+            else:
+                table = lists
+        state.rec_neighbor_table = table
+        return table
+    
+    def load_svd_embedding(self, path=None, state=None):
+        '''Loads the dense embedding of the rec_data games the 'svd' mode scores in (built offline by embedding.py)'''
+        state = state or self.state
+        path = path or self.embedding_path
+        
+        arrays = load_embedding(path)
+        if not np.array_equal(arrays['app_ids'], state.rec_data['AppID'].values):
+            raise ValueError(f"{path} was built for a different rec_data.csv, rebuild it with embedding.py")
+        if arrays['components'].shape[1] != state.normalized_features.shape[1]:
+            raise ValueError(f"{path} was built for a different vectorizer, rebuild it with embedding.py")
+        if not built_for(arrays, state):
+            raise ValueError(f"{path} was built from other feature rows (e.g. before a catalog update), "
+                             "rebuild it with embedding.py")
+        state.embedding = arrays
+    
+    def get_recommendations_full_catalog(self, user_games, n=5, max_price=None, min_wilson_score=None):
+        '''
+        Same as get_recommendations but recommends from every game in full_data instead of only rec_data.
+        
+        Only the games in the neighbour lists of the user's games are scored, so the catalog never has to be scored
+        as a whole. Fewer than n games can come back if the filters remove most of the neighbours.
+        
+        output:
+        indices of the recommended games in full_data and their similarity scores
+        '''
+        state = self.state
+        if state.neighbor_lists is None:
+            self.load_full_catalog(state=state)
+        
+        try:
+            user_feature_vectors_avg = self.preprocess_user_input(user_games, state)
+        except Exception as e:
+            print(f"Error preprocessing user games: {e}")
+            return [], []
+        
+        # Candidates are the union of the neighbour lists of the user's games
+        rows = state.full_catalog_filters.rows(user_games)
+        candidates = np.unique(state.neighbor_lists['neighbors'][rows])
+        
+        keep = state.full_catalog_filters.mask(exclude_ids=user_games, max_price=max_price, min_wilson_score=min_wilson_score)
+        candidates = candidates[keep[candidates]]
+        
+        # Exact cosine similarity of the candidates only
+        user_vector = normalize(user_feature_vectors_avg).toarray().ravel().astype(state.dtype, copy=False)
+        candidate_scores = state.full_catalog_features[candidates] @ user_vector
+        
+        top = top_n_indices(candidate_scores, np.arange(len(candidates)), n)
+        if not len(top):
+            raise ValueError("No recommendations found matching the specified criteria")
+        
+        return candidates[top].tolist(), candidate_scores[top]
+    
+    def check_game(self, game):
+        '''
+        game is a string that is the name of a game
+        
+        output:
+        Outputs True or False if the game is in the dataset
+        '''
+        catalog_index = self.state.catalog_index
+        
+        if catalog_index.row(game) is not None:
+            return True
+        
+        matching_games = catalog_index.ids_for_name(game)
+        
+        if not matching_games:
+            print('Game not found in the dataset.')
+            return False  # Game name not found
+        elif len(matching_games) > 1:
+            print('Multiple games with this name found. Please use the AppID to specify.')
+            return False  # Multiple games with the same name
+        else:
+            return True  # Unique game name found
+    
+    def get_game_id(self, game):
+        '''
+        input: game name or id
+        
+        output:
+        Outputs the id of the games (the first one if several games share the name), None if it isn't found
+        '''
+        catalog_index = self.state.catalog_index
+        
+        # if its an id or game name, return the id
+        
+        if catalog_index.row(game) is not None:
+            return int(game)
+        
+        matching_games = catalog_index.ids_for_name(game)
+        if matching_games:
+            return matching_games[0]
+        return None
+
+
+# Shared engine behind the module level functions, loads on first use
+engine = RecommenderEngine()
+
+
+def preprocess_user_input(user_games):
+    return engine.preprocess_user_input(user_games)
+
+
+def get_recommendations(user_games, n=5, max_price=None, min_wilson_score=None, exclusions=None, weights=None,
+                        mode='exact'):
+    return engine.get_recommendations(user_games, n=n, max_price=max_price, min_wilson_score=min_wilson_score,
+                                      exclusions=exclusions, weights=weights, mode=mode)
+
+
+def recommendation_cursor(user_games, page_size=10, max_price=None, min_wilson_score=None, exclusions=None,
+                          weights=None, mode='exact', ranked=None):
+    return engine.recommendation_cursor(user_games, page_size=page_size, max_price=max_price,
+                                        min_wilson_score=min_wilson_score, exclusions=exclusions, weights=weights,
+                                        mode=mode, ranked=ranked)
+
+
+def load_full_catalog(path=None):
+    engine.load_full_catalog(path)
+
+
+def get_recommendations_batch(selections, n=5, max_price=None, min_wilson_score=None, chunk_size=64):
+    return engine.get_recommendations_batch(selections, n=n, max_price=max_price, min_wilson_score=min_wilson_score,
+                                            chunk_size=chunk_size)
+
+
+def get_recommendations_full_catalog(user_games, n=5, max_price=None, min_wilson_score=None):
+    return engine.get_recommendations_full_catalog(user_games, n=n, max_price=max_price, min_wilson_score=min_wilson_score)
+
+
+def check_game(game):
+    return engine.check_game(game)
+
+
+def get_game_id(game):
+    return engine.get_game_id(game)
+
+
+def __getattr__(name):
+    '''
+    Keeps rec.full_data, rec.rec_data, rec.weighted_features etc. working now that nothing is loaded at import,
+    they come from the shared engine (and load it on first access)
+    '''
+    if name in ('full_data', 'rec_data', 'scaler', 'scaler1', 'vectorizer', 'weighted_features', 'full_features',
+                'normalized_features', 'catalog_index', 'rec_filters'):
+        return getattr(engine.state, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # def get_game_index(list_of_ids):
@@ -0,0 +1,108 @@
+'''
+Substring search over game names for the Application search box.
+
+Names are lowercased once and ranked by wilson score (best first). Every trigram of a name points to the ranks of
+the names that contain it, in ascending order, so intersecting the postings of a query's trigrams gives the
+candidates already sorted by wilson score and only those get checked with a real substring test.
+'''
+import numpy as np
+
+
+def _normalize(name):
+    return name.lower() if isinstance(name, str) else ''
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class NameSearchIndex:
+    '''
+    Trigram index over the game names.
+
+    Parameters:
+    - names: game names (display form)
+    - app_ids: AppID of every name
+    - wilson_scores: used to rank the matches, best first
+    '''
+
+    def __init__(self, names, app_ids, wilson_scores):
+        order = np.argsort(-np.nan_to_num(np.asarray(wilson_scores, dtype=float), nan=-1.0), kind='stable')
+        self.names = np.asarray(names, dtype=object)[order]
+        self.app_ids = np.asarray(app_ids)[order]
+        self.normalized = [_normalize(name) for name in self.names]
+        self.all_ranks = np.arange(len(self.names), dtype=np.int32)
+
+        postings = {}
+        for rank, name in enumerate(self.normalized):
+            for trigram in _trigrams(name):
+                postings.setdefault(trigram, []).append(rank)
+        self.postings = {trigram: np.array(ranks, dtype=np.int32) for trigram, ranks in postings.items()}
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(data['Name'].values, data['AppID'].values, data['wilson_score'].values)
+
+    def candidates(self, query):
+        '''Ranks that can contain query: the intersection of its trigram postings (every rank for short queries)'''
+        trigrams = _trigrams(query)
+        if not trigrams:
+            return self.all_ranks
+
+        lists = sorted((self.postings.get(trigram) for trigram in trigrams), key=lambda ranks: 0 if ranks is None else len(ranks))
+        if lists[0] is None:
+            return self.all_ranks[:0]
+
+        ranks = lists[0]
+        for other in lists[1:]:
+            ranks = np.intersect1d(ranks, other, assume_unique=True)
+            if not len(ranks):
+                break
+        return ranks
+
+    def matches(self, query, candidates=None):
+        '''Ranks of every name containing query (already normalized), best wilson score first'''
+        if candidates is None:
+            candidates = self.candidates(query)
+        normalized = self.normalized
+        return np.fromiter((rank for rank in candidates if query in normalized[rank]), dtype=np.int32)
+
+    def session(self):
+        return SearchSession(self)
+
+
+class SearchSession:
+    '''
+    Search state of one search box. When the new query contains the previous one (the user typed another
+    character) only the previous matches are checked again instead of going back to the index.
+    '''
+
+    def __init__(self, index):
+        self.index = index
+        self.last_query = None
+        self.last_matches = None
+
+    def matches(self, query):
+        '''Ranks of every name containing query, best wilson score first'''
+        query = _normalize(query)
+        if not query:
+            self.last_query, self.last_matches = None, None
+            return self.index.all_ranks[:0]
+
+        if query == self.last_query:
+            return self.last_matches
+
+        if self.last_query is not None and self.last_query in query:
+            matches = self.index.matches(query, self.last_matches)
+        else:
+            matches = self.index.matches(query)
+
+        self.last_query, self.last_matches = query, matches
+        return matches
+
+    def search(self, query, limit=100):
+        '''
+        Returns the names and AppIDs of the top limit matches (every match when limit is None), best wilson score first
+        '''
+        top = self.matches(query)[:limit]
+        return self.index.names[top], self.index.app_ids[top]
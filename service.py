@@ -0,0 +1,254 @@
+'''
+HTTP/JSON recommendation service: loads the engine once and answers many users from one warm process.
+
+Endpoints:
+- GET  /health
+- GET  /game_id?game=<name or AppID>                       -> {"game": ..., "app_id": ... or null}
+- GET  /recommendations?games=<AppID>,<AppID>&n=5&max_price=10&min_wilson_score=0.5
+- POST /recommendations  {"games": [AppID, ...], "n": 5, "max_price": 10, "min_wilson_score": 0.5}
+  -> {"recommendations": [{"app_id", "name", "price", "wilson_score", "score"}, ...]}
+
+Recommendation requests that arrive within batch_window_ms of each other are answered together with
+RecommenderEngine.get_recommendations_many, one sparse matrix - matrix product for the whole batch.
+
+Only the standard library (asyncio) is used for the server. Load test it with loadtest.py.
+
+Usage:
+python service.py --port 8080 --batch-window-ms 2 --max-batch 64
+'''
+import argparse
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from recfunctions import RecommenderEngine
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class BadRequest(Exception):
+    pass
+
+
+class MicroBatcher:
+    '''
+    Queues recommendation requests and answers them in batches on one scoring thread, so the event loop keeps
+    accepting requests while a batch is scored.
+
+    Parameters:
+    - engine: RecommenderEngine
+    - window_ms: how long the first request of a batch waits for others to join it
+    - max_batch: largest batch, a full batch is scored right away
+    '''
+
+    def __init__(self, engine, window_ms=2, max_batch=64):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scoring')
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, user_games, n=5, max_price=None, min_wilson_score=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((user_games, n, max_price, min_wilson_score), future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    # Take whatever already arrived without waiting any longer
+                    try:
+                        batch.append(self.queue.get_nowait())
+                        continue
+                    except asyncio.QueueEmpty:
+                        break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.engine.get_recommendations_many, requests)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+
+def _number(value, name, kind=float):
+    if value is None or value == '':
+        return None
+    # int(True) and int(1.5) would quietly turn into 1
+    if isinstance(value, bool):
+        raise BadRequest(f"{name} must be a number")
+    if kind is int and isinstance(value, float) and not value.is_integer():
+        raise BadRequest(f"{name} must be a whole number")
+    try:
+        number = kind(value)
+    except (TypeError, ValueError, OverflowError):
+        raise BadRequest(f"{name} must be a number")
+    if isinstance(number, float) and not math.isfinite(number):
+        raise BadRequest(f"{name} must be a finite number")
+    return number
+
+
+class RecommendationService:
+    def __init__(self, engine, window_ms=2, max_batch=64, max_n=100):
+        self.engine = engine
+        self.batcher = MicroBatcher(engine, window_ms, max_batch)
+        self.max_n = max_n
+        self.started = time.time()
+
+    async def handle(self, reader, writer):
+        '''One client connection, HTTP/1.1 with keep-alive'''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+                status, payload = await self.dispatch(method, target, body)
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/health':
+                return 200, {'status': 'ok', 'games': len(self.engine.full_data), 'uptime_s': time.time() - self.started}
+
+            if url.path == '/game_id':
+                if method != 'GET':
+                    return 405, {'error': 'use GET'}
+                if not query.get('game'):
+                    raise BadRequest('game is required')
+                app_id = self.engine.get_game_id(query['game'])
+                return 200, {'game': query['game'], 'app_id': app_id}
+
+            if url.path == '/recommendations':
+                if method == 'POST':
+                    try:
+                        params = json.loads(body or b'{}')
+                    except ValueError:
+                        raise BadRequest('body must be JSON')
+                    if not isinstance(params, dict):
+                        raise BadRequest('body must be a JSON object')
+                    games = params.get('games')
+                elif method == 'GET':
+                    params = query
+                    games = [game for game in query.get('games', '').split(',') if game]
+                else:
+                    return 405, {'error': 'use GET or POST'}
+                return 200, await self.recommendations(games, params)
+
+            return 404, {'error': f"no endpoint {url.path}"}
+        except BadRequest as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            print(f"Error handling {method} {target}: {e}")
+            return 500, {'error': 'internal error'}
+
+    async def recommendations(self, games, params):
+        if not isinstance(games, list) or not games:
+            raise BadRequest('games must be a non empty list of AppIDs')
+        user_games = [_number(game, 'games', int) for game in games]
+        n = _number(params.get('n'), 'n', int)
+        n = 5 if n is None else n
+        if not 0 < n <= self.max_n:
+            raise BadRequest(f"n must be between 1 and {self.max_n}")
+        max_price = _number(params.get('max_price'), 'max_price')
+        min_wilson_score = _number(params.get('min_wilson_score'), 'min_wilson_score')
+
+        try:
+            indices, scores = await self.batcher.submit(user_games, n, max_price, min_wilson_score)
+        except ValueError as e:
+            # No valid games, or nothing passed the filters
+            if 'No valid games' in str(e):
+                raise BadRequest(str(e))
+            return {'recommendations': [], 'message': str(e)}
+
+        rec_data = self.engine.rec_data
+        return {'recommendations': [
+            {'app_id': int(rec_data['AppID'].values[row]), 'name': rec_data['Name'].values[row],
+             'price': float(rec_data['Price'].values[row]), 'wilson_score': float(rec_data['wilson_score'].values[row]),
+             'score': float(score)}
+            for row, score in zip(indices, scores)
+        ]}
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.batcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve recommendations over HTTP/JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--artifacts', default='Artifacts')
+    parser.add_argument('--batch-window-ms', type=float, default=2, help='0 with --max-batch 1 turns batching off')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--compact', action='store_true', help='score with float32 / int32 matrices')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    engine = RecommenderEngine(artifact_dir=args.artifacts, compact=args.compact).warm()
+    print(f"Loaded {len(engine.full_data)} games in {time.perf_counter() - start:.1f}s")
+
+    service = RecommendationService(engine, args.batch_window_ms, args.max_batch)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,152 @@
+'''
+Multi-process scoring of the rec_data games for large catalogs.
+
+The rows of normalized_features are split into one contiguous shard per worker. Every worker memory maps its shard
+and the Price / wilson_score columns straight from an artifact directory (python artifacts.py export) once at
+startup, so the OS page cache holds one copy of the matrix for all of them and nothing but the user vector is sent
+per request. Each worker scores its rows, applies the filters and sends back its own top n, the parent merges them.
+
+RecommenderEngine(workers=N) uses this for get_recommendations when it runs on an artifact directory.
+With compact=True (a compact engine) the workers score in float32 like the engine, on float64 artifacts they map the
+float32 copy of the matrix the engine wrote next to it (artifacts.matrix_spec), so that is shared the same way.
+'''
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from artifacts import matrix_spec
+
+
+def shard_bounds(n_rows, n_shards):
+    '''Row ranges (start, stop) of n_shards contiguous shards of about the same size'''
+    edges = np.linspace(0, n_rows, n_shards + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def _load_shard(path, manifest, start, stop, compact=False):
+    spec = matrix_spec(path, manifest, 'normalized_features', compact)
+    data, indices, indptr = (np.load(os.path.join(path, spec[part]), mmap_mode='r') for part in ('data', 'indices', 'indptr'))
+    low, high = int(indptr[start]), int(indptr[stop])
+    # data and indices stay views of the memory mapped files, only the shard's indptr gets copied
+    shard = csr_matrix((data[low:high], indices[low:high], np.asarray(indptr[start:stop + 1]) - low),
+                       shape=(stop - start, spec['shape'][1]), copy=False)
+
+    columns = manifest['tables']['rec_data']['columns']
+    price, wilson_score = (np.load(os.path.join(path, columns[column]['file']), mmap_mode='r')[start:stop]
+                           for column in ('Price', 'wilson_score'))
+    return shard, price, wilson_score
+
+
+def _worker(path, manifest, start, stop, connection, compact=False):
+    # Imported here, recfunctions imports this module
+    from recfunctions import top_n_indices
+
+    shard, price, wilson_score = _load_shard(path, manifest, start, stop, compact)
+    connection.send('ready')
+
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        user_vector, exclude_rows, n, max_price, min_wilson_score = request
+        try:
+            scores = shard @ user_vector
+
+            # Same rules as FilterIndex.mask: games with a missing value are never filtered out
+            keep = np.ones(stop - start, dtype=bool)
+            exclude_rows = exclude_rows[(exclude_rows >= start) & (exclude_rows < stop)]
+            keep[exclude_rows - start] = False
+            if max_price is not None:
+                keep &= ~(price > max_price)
+            if min_wilson_score is not None:
+                keep &= ~(wilson_score < min_wilson_score)
+
+            candidates = np.flatnonzero(keep)
+            top = top_n_indices(scores, candidates, n)
+            connection.send((top + start, scores[top], len(candidates)))
+        except Exception as e:
+            connection.send(e)
+
+    connection.close()
+
+
+class ShardedScorer:
+    '''
+    Persistent pool of scoring processes over the rec_data rows of an artifact directory.
+
+    Parameters:
+    - path: artifact directory
+    - manifest: its manifest (artifacts.read_manifest)
+    - workers: number of processes / shards
+    - compact: score in float32 like a compact engine, whatever precision the artifacts are stored in
+    '''
+
+    def __init__(self, path, manifest, workers=None, compact=False):
+        self.workers = workers or os.cpu_count() or 1
+        n_rows = manifest['matrices']['normalized_features']['shape'][0]
+        self.bounds = shard_bounds(n_rows, self.workers)
+        self.dtype = np.dtype(manifest['matrices']['normalized_features'].get('dtype', 'float64'))
+        if compact:
+            self.dtype = np.dtype(np.float32)
+        self._lock = threading.Lock()
+        self._connections = []
+        self._processes = []
+
+        # spawn rather than fork: the parent can be a Tk app with running threads
+        context = multiprocessing.get_context('spawn')
+        for start, stop in self.bounds:
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(path, manifest, start, stop, child, compact), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+        for connection in self._connections:
+            connection.recv()
+
+    def top_n(self, user_vector, exclude_rows=(), n=5, max_price=None, min_wilson_score=None):
+        '''
+        Top n rec_data rows for a normalized dense user vector under the filters, best first
+
+        output:
+        rows, their scores and the number of rows that passed the filters
+        '''
+        request = (np.asarray(user_vector, dtype=self.dtype), np.asarray(exclude_rows, dtype=np.intp), n, max_price,
+                   min_wilson_score)
+
+        # One request at a time goes through the pipes, every worker answers every request
+        with self._lock:
+            for connection in self._connections:
+                connection.send(request)
+            replies = [connection.recv() for connection in self._connections]
+
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+
+        rows = np.concatenate([reply[0] for reply in replies])
+        scores = np.concatenate([reply[1] for reply in replies])
+        candidates = sum(reply[2] for reply in replies)
+
+        # The best n of the shard winners, ties in row order like a single pass over the matrix
+        order = np.lexsort((rows, -scores))[:n]
+        return rows[order], scores[order], candidates
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                try:
+                    connection.send(None)
+                    connection.close()
+                except OSError:
+                    pass
+            for process in self._processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self._connections = []
+            self._processes = []
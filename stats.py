@@ -0,0 +1,136 @@
+'''
+Opt-in timings and counters for the recommender and the Application.
+
+Nothing is recorded unless the Stats object is enabled (stats.enable() or RECOMMENDER_STATS=1 in the environment).
+While disabled, timer() hands back one shared no-op context manager and count()/observe() return right away,
+so the instrumented code pays about one attribute check per call.
+
+Every record is also passed to the hooks added with add_hook(hook), called as hook(kind, name, value) with kind
+'time' (seconds), 'value' or 'count', so the numbers can be forwarded to another metrics system.
+
+Usage:
+from stats import stats
+stats.enable()
+... queries ...
+print(stats.snapshot())
+'''
+import os
+import threading
+import time
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record('time', self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Stats:
+    '''
+    In-process aggregates of named timings, values and counters.
+
+    - timings: wall time of a stage (count, total, mean, max)
+    - values: a measured quantity per call, e.g. the candidates left after the filters (count, total, mean, min, max)
+    - counters: plain counts, e.g. cache hits and misses
+    '''
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self, hook=None):
+        if hook is not None:
+            self.add_hook(hook)
+        self.enabled = True
+        return self
+
+    def disable(self):
+        self.enabled = False
+        return self
+
+    def add_hook(self, hook):
+        '''hook(kind, name, value) gets called with every record while enabled'''
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.values = {}
+            self.counters = {}
+
+    def timer(self, name):
+        '''Context manager that records the wall time of its block as name'''
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def add_time(self, name, seconds):
+        '''Records a wall time measured elsewhere, e.g. across a callback'''
+        if self.enabled:
+            self.record('time', name, seconds)
+
+    def observe(self, name, value):
+        if self.enabled:
+            self.record('value', name, value)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.record('count', name, amount)
+
+    def record(self, kind, name, value):
+        with self._lock:
+            if kind == 'count':
+                self.counters[name] = self.counters.get(name, 0) + value
+            else:
+                table = self.timings if kind == 'time' else self.values
+                entry = table.get(name)
+                if entry is None:
+                    table[name] = [1, value, value, value]      # count, total, min, max
+                else:
+                    entry[0] += 1
+                    entry[1] += value
+                    entry[2] = min(entry[2], value)
+                    entry[3] = max(entry[3], value)
+
+        for hook in self.hooks:
+            hook(kind, name, value)
+
+    def snapshot(self):
+        '''Copy of everything recorded so far as plain dicts (timings in milliseconds)'''
+        with self._lock:
+            timings = {name: {'count': count, 'total_ms': total * 1000, 'mean_ms': total / count * 1000,
+                              'max_ms': high * 1000}
+                       for name, (count, total, low, high) in self.timings.items()}
+            values = {name: {'count': count, 'total': total, 'mean': total / count, 'min': low, 'max': high}
+                      for name, (count, total, low, high) in self.values.items()}
+            return {'timings': timings, 'values': values, 'counters': dict(self.counters)}
+
+
+# Shared Stats object the engine and the Application record into
+stats = Stats(enabled=os.environ.get('RECOMMENDER_STATS', '') not in ('', '0'))
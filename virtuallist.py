@@ -0,0 +1,69 @@
+'''
+Virtual mode for a tk.Listbox holding a long result list.
+
+The whole list is kept as arrays (names and AppIDs) and only the rows the user can see plus a buffer are inserted,
+one insert call per batch. Scrolling near the end of what is inserted pages in the next batch, so a search that
+matches tens of thousands of games shows up as fast as one that matches ten. The AppID of a row is read from the
+array by its index, nothing gets parsed back out of the display strings.
+'''
+import tkinter as tk
+
+import numpy as np
+
+
+def game_label(name, app_id):
+    return f"{name} (ID: {app_id})"
+
+
+class VirtualListbox:
+    '''
+    Parameters:
+    - listbox: the tk.Listbox to fill, its height is the number of visible rows
+    - buffer: rows inserted past the visible ones, also the size of every batch paged in on scroll
+    - label: display string of a row from its name and AppID
+    - yscrollcommand: optional command the view changes get passed on to (a scrollbar's set)
+    '''
+
+    def __init__(self, listbox, buffer=50, label=game_label, yscrollcommand=None):
+        self.listbox = listbox
+        self.buffer = buffer
+        self.label = label
+        self.yscrollcommand = yscrollcommand
+        self.names = np.empty(0, dtype=object)
+        self.app_ids = np.empty(0, dtype=np.int64)
+        self.loaded = 0
+        listbox.configure(yscrollcommand=self._on_view_change)
+
+    def __len__(self):
+        return len(self.app_ids)
+
+    def set_items(self, names, app_ids):
+        '''Replaces the list, only the first screen and the buffer get inserted'''
+        self.listbox.delete(0, tk.END)
+        self.names = names
+        self.app_ids = np.asarray(app_ids)
+        self.loaded = 0
+        self._load(int(self.listbox.cget('height')) + self.buffer)
+
+    def _load(self, count):
+        stop = min(self.loaded + count, len(self.app_ids))
+        if stop <= self.loaded:
+            return
+        labels = [self.label(name, app_id) for name, app_id in zip(self.names[self.loaded:stop], self.app_ids[self.loaded:stop])]
+        self.loaded = stop
+        self.listbox.insert(tk.END, *labels)
+
+    def _on_view_change(self, first, last):
+        # Page in the next batch once the last visible row gets within half a buffer of the end of what is inserted
+        if self.loaded < len(self.app_ids) and self.loaded - float(last) * self.loaded < self.buffer / 2:
+            self._load(self.buffer)
+        if self.yscrollcommand is not None:
+            self.yscrollcommand(first, last)
+
+    def app_id(self, index):
+        return int(self.app_ids[index])
+
+    def selected_app_id(self):
+        '''AppID of the selected row, None when nothing is selected'''
+        selection = self.listbox.curselection()
+        return self.app_id(selection[0]) if selection else None